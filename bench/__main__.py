@@ -0,0 +1,285 @@
+import argparse
+import csv
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from sheet.csv import dump_csv
+from sheet.csv import load_csv
+from sheet.expression import parse
+from sheet.sheet import Formula
+
+from .generators import GENERATORS
+
+# differences below this are ignored as noise
+MIN_TIME = 0.001
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SIZES = {
+    'chain': 1,
+    'drag': 0.1,
+    'sums': 0.5,
+    'sparse': 1,
+    'strings': 1,
+    'example': 1,
+}
+
+
+def timed(fn, *args):
+    # like timeit, garbage collection is disabled while timing
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        result = fn(*args)
+        return time.perf_counter() - start, result
+    finally:
+        gc.enable()
+
+
+def evaluate(sheet):
+    for cell in list(sheet.parsed):
+        sheet.get_value(cell)
+
+
+def edit(sheet):
+    for cell in sheet.set((0, 0), '2'):
+        sheet.get_value(cell)
+
+
+def parse_all(texts):
+    for text in texts:
+        parse(text)
+
+
+def get_cells(sheet):
+    # formulas without ranges, because the tree walker evaluates ranges
+    # cell by cell
+    return [
+        cell for cell, parsed in sheet.parsed.items()
+        if isinstance(parsed, Formula)
+        and not any(ref[0] == 'range' for ref in parsed.refs)
+    ]
+
+
+def run_compiled(sheet, cells):
+    # all dependencies are cached, so only the cells themselves are timed
+    for cell in cells:
+        try:
+            sheet.parsed[cell].fn(cell)
+        except Exception:
+            pass
+
+
+def run_walker(sheet, exprs):
+    for expr in exprs:
+        try:
+            sheet.evaluate(expr)
+        except Exception:
+            pass
+
+
+def dump(sheet):
+    dump_csv(sheet, os.devnull, display=True)
+
+
+def wait(app):
+    # wait until the background worker has calculated all visible cells
+    while app.worker.event.is_set() or any(
+        line[3] for line in app.lines.values()
+    ):
+        time.sleep(0.001)
+        app.update()
+
+
+def render(path, rows=50, cols=200):
+    import boon
+
+    from sheet.app import App
+
+    class BenchApp(App):
+        def update(self, **kwargs):
+            with self.worker.lock:
+                list(self.render(self.rows, self.cols))
+
+    app = BenchApp(path)
+    app.rows, app.cols = rows, cols
+    t_first, _ = timed(app.update)
+    wait(app)
+    t_idle, _ = timed(app.update)
+    t_page = 0
+    for _ in range(10):
+        app.on_key(boon.KEY_NPAGE)
+        t, _ = timed(app.update)
+        t_page += t
+        wait(app)
+    app.worker.stop()
+    return {
+        'render_first': t_first,
+        'render_idle': t_idle,
+        'render_page': t_page / 10,
+    }
+
+
+def startup():
+    # a new process that evaluates a small file, like most uses of --eval
+    path = os.path.join(ROOT, 'example.csv')
+    cmd = [sys.executable, '-m', 'sheet', path, '--eval', os.devnull]
+    start = time.perf_counter()
+    subprocess.run(cmd, cwd=ROOT, check=True)
+    t = time.perf_counter() - start
+    # the cumulative time of the last line of -X importtime
+    cmd = [sys.executable, '-X', 'importtime', '-c', 'import sheet.__main__']
+    p = subprocess.run(cmd, cwd=ROOT, check=True, capture_output=True, text=True)
+    t_import = int(p.stderr.splitlines()[-1].split('|')[1]) / 1_000_000
+    return {
+        'startup.eval': t,
+        'startup.import': t_import,
+    }
+
+
+def memory(path):
+    # peak size of the memory that python allocates while a sheet is loaded
+    # and evaluated
+    tracemalloc.start()
+    try:
+        sheet = load_csv(path)
+        _, loaded = tracemalloc.get_traced_memory()
+        evaluate(sheet)
+        _, evaluated = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'memory.load': loaded / 1_000_000,
+        'memory.eval': evaluated / 1_000_000,
+    }
+
+
+def run_case(path):
+    with open(path) as fh:
+        texts = [
+            raw[1:] for row in csv.reader(fh) for raw in row if raw[:1] == '='
+        ]
+    t_parse, _ = timed(parse_all, texts)
+    t_load, sheet = timed(load_csv, path)
+    t_eval, _ = timed(evaluate, sheet)
+    cells = get_cells(sheet)
+    exprs = [sheet.get_parsed(cell) for cell in cells]
+    t_compiled, _ = timed(run_compiled, sheet, cells)
+    t_walk, _ = timed(run_walker, sheet, exprs)
+    t_edit, _ = timed(edit, sheet)
+    t_dump, _ = timed(dump, load_csv(path))
+    results = {
+        'parse': t_parse,
+        'load': t_load,
+        'eval': t_eval,
+        'compiled': t_compiled,
+        'walk': t_walk,
+        'edit': t_edit,
+        'dump': t_dump,
+    }
+    if os.environ.get('TERM'):
+        results.update(render(path))
+    return results
+
+
+def run(names, size, repeat):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in names:
+            path = os.path.join(tmp, f'{name}.csv')
+            with open(path, 'w') as fh:
+                rows = GENERATORS[name](int(size * SIZES[name]))
+                csv.writer(fh).writerows(rows)
+            for _ in range(repeat):
+                for key, value in run_case(path).items():
+                    key = f'{name}.{key}'
+                    results[key] = min(results.get(key, value), value)
+            print(name, file=sys.stderr)
+        # a block of cells, only once because tracing allocations is slow
+        path = os.path.join(tmp, 'memory.csv')
+        with open(path, 'w') as fh:
+            csv.writer(fh).writerows(GENERATORS['drag'](size // 5))
+        results.update(memory(path))
+    for _ in range(repeat):
+        for key, value in startup().items():
+            results[key] = min(results.get(key, value), value)
+    return results
+
+
+def format_value(key, value) -> str:
+    if key.startswith('memory.'):
+        return f'{value:8.1f}MB'
+    return f'{value:9.4f}s'
+
+
+def compare(results, baseline, threshold) -> bool:
+    ok = True
+    for key, value in results.items():
+        old = baseline.get(key)
+        if old is None:
+            print(f'{key:24} {format_value(key, value)}')
+            continue
+        ratio = value / old if old else 1
+        mark = ''
+        if max(value, old) < MIN_TIME:
+            pass
+        elif ratio > 1 + threshold:
+            mark = ' slower'
+            ok = False
+        elif ratio < 1 - threshold:
+            mark = ' faster'
+        print(
+            f'{key:24} {format_value(key, value)} {format_value(key, old)} '
+            f'{ratio:6.2f}x{mark}'
+        )
+    return ok
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='python -m bench')
+    parser.add_argument('names', nargs='*', help=', '.join(GENERATORS))
+    parser.add_argument('--size', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write results as JSON')
+    parser.add_argument('--baseline', help='compare to results from a JSON file')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    return parser
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in GENERATORS:
+            parser.error(f'unknown benchmark: {name}')
+    results = run(args.names or list(GENERATORS), args.size, args.repeat)
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump({
+                'python': platform.python_version(),
+                'size': args.size,
+                'results': results,
+            }, fh, indent=2)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as fh:
+            data = json.load(fh)
+        if data['size'] != args.size:
+            parser.error(f'baseline was created with --size {data["size"]}')
+        baseline = data['results']
+    if not compare(results, baseline, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
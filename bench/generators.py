@@ -0,0 +1,68 @@
+import random
+
+from sheet.expression import x2col
+
+
+def chain(n):
+    # every cell depends on the one above
+    return [['1']] + [[f'=A{y}+1'] for y in range(1, n)]
+
+
+def drag(n, width=20):
+    # a block of formulas like the ones created by drag mode
+    rows = []
+    for y in range(1, n + 1):
+        row = [str(y)]
+        for x in range(1, width):
+            col = x2col(x - 1)
+            row.append(f'={col}{y}*2+$A$1')
+        rows.append(row)
+    return rows
+
+
+def sums(n):
+    # running totals over growing ranges
+    return [
+        [str(y), f'=sum(A$1:A{y})', f'=max(A1:A{y})']
+        for y in range(1, n + 1)
+    ]
+
+
+def sparse(n, count=100):
+    # a few values and aggregates over very tall ranges of their column
+    rows = n * 1000
+    return [
+        [str(y), f'=sum(A1:A{rows})', f'=max(A$1:A{rows - y})']
+        for y in range(1, count + 1)
+    ]
+
+
+def strings(n, width=5):
+    rnd = random.Random(n)
+    words = ['foo', 'bar', 'baz', 'qux', 'lorem', 'ipsum', 'dolor']
+    return [
+        [' '.join(rnd.choices(words, k=3)) for _ in range(width)]
+        for _ in range(n)
+    ]
+
+
+def example(n):
+    # the pattern from example.csv
+    rows = [['-10', '=1 / (1 + A1*A1 / 10)', '=bar(B1)']]
+    for y in range(2, n + 1):
+        rows.append([
+            f'=A{y - 1}+1',
+            f'=1 / (1 + A{y}*A{y} / 10)',
+            f'=bar(B{y})',
+        ])
+    return rows
+
+
+GENERATORS = {
+    'chain': chain,
+    'drag': drag,
+    'sums': sums,
+    'sparse': sparse,
+    'strings': strings,
+    'example': example,
+}
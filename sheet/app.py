@@ -0,0 +1,436 @@
+import os
+import selectors
+
+import boon
+from wcwidth import wcswidth
+
+from .csv import dump_csv
+from .csv import load_csv
+from .expression import move_pos
+from .expression import x2col
+from .history import History
+from .input import Input
+from .profile import Profile
+from .sheet import Bar
+from .sheet import Formula
+from .sheet import Sheet
+from .sheet import iter_range
+from .term import align_center
+from .term import align_left
+from .term import align_right
+from .term import blue
+from .term import get_width
+from .term import green
+from .term import invert
+from .term import red
+from .worker import Worker
+
+HELP = """
+Help
+---
+
+arrow keys   - move the cursor
+page up/down - move one screen up/down
+enter        - start edit mode
+=, -, 0-9    - start quick edit mode
+#            - start drag mode
+v            - start visual mode
+del          - delete
+u, U         - undo, redo
+r, R         - insert, delete row
+c, C         - insert, delete column
+>, <         - adjust column width
+w            - write to file (source form)
+W            - write to file (evaluated form)
+h            - show help
+q            - quit
+"""
+
+# marks a value that is still being calculated
+PENDING = object()
+
+
+def to_cell(value: float|int|str|None|Exception, width: int) -> str:
+    if value is PENDING:
+        return align_right('...', width)
+    elif isinstance(value, float|int):
+        s = f'{{:{width}.{min(width - 2, 6)}g}}'.format(value)
+        return align_right(s, width)
+    elif isinstance(value, str):
+        return align_left(value, width)
+    elif isinstance(value, Bar):
+        return value.render(width)
+    elif value is None:
+        return ' ' * width
+    elif isinstance(value, Exception):
+        return red(align_left(repr(value), width))
+
+
+class App(boon.App):
+    def __init__(self, path=None, *, profile=False, db=None):
+        super().__init__()
+        self.path = path or ''
+        if path:
+            self.sheet = load_csv(self.path, lazy=True, db=db)
+        elif db:
+            from .tiles import Database
+            self.sheet = Database(db).sheet()
+        else:
+            self.sheet = Sheet()
+        self.sheet.dirty = set()
+        self.profile = Profile(self.sheet) if profile else None
+        self.history = History(self.sheet)
+        self.wake_in, self.wake_out = os.pipe2(os.O_NONBLOCK)
+        self.selector.register(self.wake_in, selectors.EVENT_READ, self.on_wake)
+        self.worker = Worker(self.sheet, self.wake)
+        self.head = None
+        self.lines = {}
+        self.x0 = 0
+        self.y0 = 0
+        self.cursor_x = 0
+        self.cursor_y = 0
+        self.widths = {}
+        self.input = None
+        self.drag = None
+        self.visual = None
+        self.clipboard_pos = (0, 0)
+        self.clipboard = [[]]
+        self.help = False
+
+    @property
+    def cursor(self):
+        return self.cursor_x, self.cursor_y
+
+    def scroll_into_view(self, rows, cols):
+        if self.cursor_y < self.y0:
+            self.y0 = self.cursor_y
+        elif self.cursor_y > self.y0 + rows - 3:
+            self.y0 = self.cursor_y - rows + 3
+
+        if self.cursor_x < self.x0:
+            self.x0 = self.cursor_x
+        else:
+            widths = [self.get_width(x) for x in range(self.x0, self.cursor_x + 1)]
+            offset = 0
+            while 4 + sum(widths[offset:]) > cols:
+                offset += 1
+            self.x0 += offset
+
+    def render(self, rows, cols):
+        if self.help:
+            lines = HELP.strip().split('\n')
+            max_width = max(wcswidth(line) for line in lines)
+            x_offset = max(0, cols - max_width) // 2
+            y_offset = max(0, rows - len(lines)) // 2
+            for _ in range(y_offset):
+                yield ''
+            for line in lines:
+                yield ' ' * x_offset + line
+            return
+
+        self.scroll_into_view(rows, cols)
+
+        columns = []
+        x = self.x0
+        width = 4 + self.get_width(x)
+        while width <= cols:
+            columns.append((x, self.get_width(x)))
+            x += 1
+            width += self.get_width(x)
+        columns = tuple(columns)
+
+        lines = [self.render_head(columns)]
+
+        # rows are only rendered again if one of their cells was invalidated
+        # or their layout or highlighting changed or they are still pending
+        dirty = {y for _, y in self.sheet.dirty}
+        changed = bool(self.sheet.dirty)
+        self.sheet.dirty.clear()
+        cache = {}
+        pending = []
+        for y in range(self.y0, self.y0 + rows - 2):
+            key = (
+                columns,
+                self.cursor_x if y == self.cursor_y else None,
+                self.get_selection(y),
+            )
+            old_key, line, cells, waiting = self.lines.get(
+                y, (None, None, {}, [])
+            )
+            if key != old_key or y in dirty or waiting:
+                line, cells = self.render_row(y, key, cells)
+                waiting = [
+                    (x, y) for x, (cell_key, _) in cells.items()
+                    if cell_key[2] is PENDING
+                ]
+            cache[y] = (key, line, cells, waiting)
+            pending += waiting
+            lines.append(line)
+        self.lines = cache
+        self.worker.request(pending, changed)
+
+        if self.input:
+            lines.append(self.input.render(cols))
+        else:
+            line = self.sheet.get_raw(self.cursor)
+            if self.profile:
+                stats = self.profile.summary()
+                space = cols - get_width(line) - get_width(stats)
+                line += ' ' * max(space, 1) + stats
+            lines.append(line)
+
+        yield from lines
+
+    def render_head(self, columns):
+        key = (columns, self.cursor_x)
+        if self.head is None or self.head[0] != key:
+            heads = [' ' * 4]
+            for x, width in columns:
+                head = align_center(x2col(x), width)
+                if x == self.cursor_x:
+                    head = invert(head)
+                heads.append(head)
+            self.head = (key, ''.join(heads))
+        return self.head[1]
+
+    def get_selection(self, y):
+        # (color, x1, x2) for every drag or visual selection in row y
+        selection = []
+        for corner, color in [(self.drag, blue), (self.visual, green)]:
+            if corner and min(corner[1], self.cursor_y) <= y <= max(
+                corner[1], self.cursor_y
+            ):
+                x1, x2 = sorted((corner[0], self.cursor_x))
+                selection.append((color, x1, x2))
+        return tuple(selection)
+
+    def render_row(self, y, key, old_cells):
+        # cells are only formatted again if their width, value or
+        # highlighting changed
+        columns, cursor_x, selection = key
+        head = align_center(str(y + 1), 4)
+        if cursor_x is not None:
+            head = invert(head)
+        parts = [head]
+        cells = {}
+        for x, width in columns:
+            value = self.get_value((x, y))
+            color = next((c for c, x1, x2 in selection if x1 <= x <= x2), None)
+            cell_key = (width, type(value), value, color, x == cursor_x)
+            old = old_cells.get(x)
+            if old is not None and old[0] == cell_key:
+                cell = old[1]
+            else:
+                cell = to_cell(value, width)
+                if color:
+                    cell = color(cell)
+                if x == cursor_x:
+                    cell = invert(cell)
+            cells[x] = (cell_key, cell)
+            parts.append(cell)
+        return ''.join(parts), cells
+
+    def get_value(self, cell):
+        # formulas are calculated in the background
+        if (
+            isinstance(self.sheet.load(cell), Formula)
+            and cell not in self.sheet.cache
+        ):
+            return PENDING
+        return self.sheet.get_value(cell)
+
+    def update(self, **kwargs):
+        with self.worker.lock:
+            super().update(**kwargs)
+
+    def wake(self):
+        # called from the worker thread
+        try:
+            os.write(self.wake_out, b'.')
+        except BlockingIOError:
+            pass
+
+    def on_wake(self):
+        while True:
+            try:
+                os.read(self.wake_in, 1024)
+            except BlockingIOError:
+                break
+
+    def get_width(self, x):
+        return self.widths.get(x, 10)
+
+    def set_width(self, x, value):
+        self.widths[x] = max(value, 3)
+
+    def change_width(self, x, d):
+        old = self.get_width(x)
+        self.set_width(x, old + d)
+
+    def submit_input(self):
+        with self.history.record():
+            self.sheet.set(self.cursor, self.input.value)
+        self.input = None
+
+    def cancel_input(self):
+        self.input = None
+
+    def submit_write(self):
+        self.path = self.input.value
+        dump_csv(self.sheet, self.input.value)
+        self.input = None
+
+    def submit_write_eval(self):
+        dump_csv(self.sheet, self.input.value, display=True)
+        self.input = None
+
+    def submit_drag(self):
+        raw = self.sheet.get_raw(self.drag)
+        with self.history.record():
+            for x, y in iter_range(self.cursor, self.drag):
+                shift = (x - self.drag[0], y - self.drag[1])
+                self.sheet.set_shifted((x, y), raw, shift)
+        self.drag = None
+
+    def cancel_drag(self):
+        self.drag = None
+
+    def copy(self):
+        x1, x2 = sorted((self.cursor_x, self.visual[0]))
+        y1, y2 = sorted((self.cursor_y, self.visual[1]))
+        self.clipboard_pos = (x1, y1)
+        self.clipboard = [
+            [self.sheet.get_raw((x, y)) for x in range(x1, x2 + 1)]
+            for y in range(y1, y2 + 1)
+        ]
+
+    def paste(self):
+        shift = (
+            self.cursor_x - self.clipboard_pos[0],
+            self.cursor_y - self.clipboard_pos[1],
+        )
+        with self.history.record():
+            for dy, row in enumerate(self.clipboard):
+                for dx, raw in enumerate(row):
+                    pos = (self.cursor_x + dx, self.cursor_y + dy)
+                    self.sheet.set_shifted(pos, raw, shift)
+
+    def move(self, axis, n):
+        # insert or delete rows or columns at the cursor
+        at = self.cursor[axis]
+        self.history.move(axis, at, n)
+        if axis == 0:
+            widths = {}
+            for x, width in self.widths.items():
+                x = move_pos(x, at, n)
+                if x >= 0:
+                    widths[x] = width
+            self.widths = widths
+        self.reset()
+
+    def reset(self):
+        # cells may have moved, so all rows are rendered again
+        self.lines = {}
+        self.worker.request([])
+
+    def on_key(self, key):
+        with self.worker.lock:
+            self.handle_key(key)
+
+    def handle_key(self, key):
+        if self.input:
+            if not self.input.full and key in [
+                boon.KEY_DOWN,
+                boon.KEY_UP,
+                boon.KEY_NPAGE,
+                boon.KEY_PPAGE,
+                boon.KEY_RIGHT,
+                boon.KEY_LEFT,
+            ]:
+                self.submit_input()
+                self.handle_key(key)
+            else:
+                self.input.on_key(key)
+        elif key == 'h':
+            self.help = not self.help
+        elif key == 'q' and self.help:
+            self.help = False
+        elif key == 'q':
+            self.running = False
+        elif key == boon.KEY_DOWN:
+            self.cursor_y += 1
+        elif key == boon.KEY_UP:
+            self.cursor_y = max(self.cursor_y - 1, 0)
+        elif key == boon.KEY_NPAGE:
+            self.cursor_y += self.rows - 3
+        elif key == boon.KEY_PPAGE:
+            self.cursor_y = max(self.cursor_y - (self.rows - 3), 0)
+        elif key == boon.KEY_RIGHT:
+            self.cursor_x += 1
+        elif key == boon.KEY_LEFT:
+            self.cursor_x = max(self.cursor_x - 1, 0)
+        elif self.drag is not None:
+            if key == '\n':
+                self.submit_drag()
+            elif key == boon.KEY_ESC:
+                self.cancel_drag()
+        elif self.visual is not None:
+            if key in ['y', 'd', boon.KEY_DEL]:
+                self.copy()
+                if key in ['d', boon.KEY_DEL]:
+                    with self.history.record():
+                        for pos in iter_range(self.cursor, self.visual):
+                            self.sheet.set(pos, '')
+                self.cursor_x, self.cursor_y = self.visual
+                self.visual = None
+            elif key in ['\n', boon.KEY_ESC]:
+                self.visual = None
+        elif key == 'p':
+            self.paste()
+        elif key == '>':
+            self.change_width(self.cursor_x, 1)
+        elif key == '<':
+            self.change_width(self.cursor_x, -1)
+        elif key == '\n':
+            raw = self.sheet.get_raw(self.cursor)
+            self.input = Input(raw, self.submit_input, self.cancel_input, full=True)
+        elif key in '-=0123456789':
+            self.input = Input(key, self.submit_input, self.cancel_input, full=False)
+        elif key == boon.KEY_DEL:
+            with self.history.record():
+                self.sheet.set(self.cursor, '')
+        elif key == 'u':
+            self.history.undo()
+            self.reset()
+        elif key == 'U':
+            self.history.redo()
+            self.reset()
+        elif key == 'r':
+            self.move(1, 1)
+        elif key == 'R':
+            self.move(1, -1)
+        elif key == 'c':
+            self.move(0, 1)
+        elif key == 'C':
+            self.move(0, -1)
+        elif key == '#':
+            self.drag = self.cursor
+        elif key == 'v':
+            self.visual = self.cursor
+        elif key == 'w':
+            self.input = Input(
+                self.path,
+                self.submit_write,
+                self.cancel_input,
+                prompt='Write: ',
+                full=True,
+            )
+        elif key == 'W':
+            self.input = Input(
+                self.path,
+                self.submit_write_eval,
+                self.cancel_input,
+                prompt='Write (evaluated): ',
+                full=True,
+            )
+
@@ -2,6 +2,11 @@ import csv
 
 from .sheet import Bar
 from .sheet import Sheet
+from .snapshot import EXTENSION
+from .snapshot import dump_snapshot
+from .snapshot import load_snapshot
+from .store import CellStore
+from .vector import vectorize
 
 
 def to_display(value: float|int|str|Bar|None|Exception) -> str:
@@ -19,10 +24,70 @@ def to_display(value: float|int|str|Bar|None|Exception) -> str:
         return repr(value)
 
 
-def load_csv(path, **kwargs):
-    sheet = Sheet()
+class LazyReader:
+    # reads rows only when they are needed and keeps the raw text until the
+    # cells are parsed
+    def __init__(self, fh, reader, raw=None):
+        self.fh = fh
+        self.reader = reader
+        self.rows = 0
+        self.raw = CellStore() if raw is None else raw
+
+    def read(self, y=None):
+        while self.reader is not None and (y is None or self.rows <= y):
+            row = next(self.reader, None)
+            if row is None:
+                self.fh.close()
+                self.reader = None
+            else:
+                for x, raw in enumerate(row):
+                    if raw:
+                        self.raw[x, self.rows] = raw
+                self.rows += 1
+
+    def close(self):
+        # rows that were not read yet are discarded
+        if self.reader is not None:
+            self.fh.close()
+            self.reader = None
+
+    def is_empty(self):
+        return self.reader is None and not self.raw
+
+    def pop(self, cell):
+        self.read(cell[1])
+        return self.raw.pop(cell, None)
+
+    def pop_range(self, x, y1, y2):
+        self.read(y2)
+        for y in range(y1, min(y2 + 1, self.rows)):
+            raw = self.raw.pop((x, y), None)
+            if raw:
+                yield y, raw
+
+    def pop_all(self):
+        self.read()
+        yield from self.raw.items()
+        self.raw.clear()
+
+
+def load_csv(path, *, lazy=False, db=None, **kwargs):
+    # with `db`, cells are stored in that file instead of memory
+    if path.endswith(EXTENSION):
+        return load_snapshot(path)
+    database = None
+    if db:
+        from .tiles import Database
+        database = Database(db)
+    sheet = database.sheet() if database else Sheet()
     dialect = 'excel-tab' if path.endswith('.tsv') else 'excel'
-    with open(path) as fh:
+    if lazy or database:
+        fh = open(path)
+        reader = csv.reader(fh, dialect=dialect, **kwargs)
+        raw = database.store('source') if database else None
+        sheet.source = LazyReader(fh, reader, raw)
+        return sheet
+    with open(path) as fh, sheet.batch():
         for y, row in enumerate(csv.reader(fh, dialect=dialect, **kwargs)):
             for x, raw in enumerate(row):
                 sheet.set((x, y), raw)
@@ -30,14 +95,25 @@ def load_csv(path, **kwargs):
 
 
 def dump_csv(sheet, path, *, display=False, **kwargs):
+    sheet.load_all()
+    if display:
+        vectorize(sheet)
+
+    if path.endswith(EXTENSION):
+        if display:
+            for cell in list(sheet.parsed):
+                sheet.get_value(cell)
+        dump_snapshot(sheet, path)
+        return
+
     if display:
         def get(cell):
             return to_display(sheet.get_value(cell))
     else:
         get = sheet.get_raw
 
-    width = max((cell[0] for cell in sheet.raw), default=0) + 1
-    height = max((cell[1] for cell in sheet.raw), default=0) + 1
+    width = max((cell[0] for cell in sheet.parsed), default=0) + 1
+    height = max((cell[1] for cell in sheet.parsed), default=0) + 1
 
     dialect = 'excel-tab' if path.endswith('.tsv') else 'excel'
     with open(path, 'w') as fh:
@@ -6,35 +6,36 @@ class ParseError(ValueError):
     pass
 
 
-def parse_any(text, parsers):
-    for parser in parsers:
-        try:
-            return parser(text)
-        except ParseError:
-            pass
-    raise ParseError(f'None of the subparsers matched for {text}')
-
-
-def parse_re(text, pattern):
-    m = re.match(pattern, text)
-    if not m:
-        raise ParseError
-    return m, text[m.end():]
-
-
-def parse_string(text):
-    m, tail = parse_re(text, r'"[^"]*"')
-    return ('str', m[0][1:-1], m[0]), tail
-
-
-def parse_float(text):
-    m, tail = parse_re(text, r'[0-9]+\.[0-9]+')
-    return ('float', float(m[0]), m[0]), tail
-
-
-def parse_int(text):
-    m, tail = parse_re(text, r'[0-9]+')
-    return ('int', int(m[0], 10), m[0]), tail
+class RefError(ParseError):
+    # formulas that refer to deleted cells
+    def __init__(self, msg='reference to deleted cell'):
+        super().__init__(msg)
+
+
+# replaces references to deleted cells
+DELETED = '#REF!'
+
+
+TOKEN_RE = re.compile(r'''
+    (?P<str>"[^"]*")
+    | (?P<float>[0-9]+\.[0-9]+)
+    | (?P<int>[0-9]+)
+    | (?P<ref>(?P<x_fixed>\$)?(?P<col>[A-Z]+)(?P<y_fixed>\$)?(?P<row>[1-9][0-9]*))
+    | (?P<name>[a-zA-Z][a-zA-Z0-9]*)
+    | (?P<op>\s*[-+*/]\s*)
+    | (?P<comma>,\s*)
+    | (?P<colon>:)
+    | (?P<lbrace>\()
+    | (?P<rbrace>\))
+    | (?P<deleted>\#REF!)
+''', re.VERBOSE)
+
+PRECEDENCE = {
+    '+': 1,
+    '-': 1,
+    '*': 2,
+    '/': 2,
+}
 
 
 def col2x(col):
@@ -56,86 +57,104 @@ def x2col(x):
     return s
 
 
-def parse_ref(text):
-    m, tail = parse_re(text, r'(\$)?([A-Z]+)(\$)?([1-9][0-9]*)')
-    x_fixed = bool(m[1])
-    x = col2x(m[2])
-    y_fixed = bool(m[3])
-    y = int(m[4], 10) - 1
-    return ('ref', (x, y), (x_fixed, y_fixed)), tail
-
-
-def parse_range(text):
-    ref1, tail = parse_ref(text)
-    _, tail = parse_re(tail, r':')
-    ref2, tail = parse_ref(tail)
-    return ('range', ref1, ref2), tail
-
-
-def parse_brace(text):
-    _, tail = parse_re(text, r'\(')
-    exp, tail = parse_expression(tail)
-    _, tail = parse_re(tail, r'\)')
-    return ('brace', exp), tail
-
-
-def parse_call(text):
-    m, tail = parse_re(text, r'[a-zA-Z][a-zA-Z0-9]*')
-    _, tail = parse_re(tail, r'\(')
-    args = []
-    commas = []
-    if tail.startswith(')'):
-        return (m[0], args, commas), tail[1:]
-    while True:
-        arg, tail = parse_expression(tail)
-        args.append(arg)
-        if tail.startswith(')'):
-            return (m[0], args, commas), tail[1:]
-        c, tail = parse_re(tail, r',\s*')
-        commas.append(c[0])
-    raise ParseError('no closing brace on function call')
-
-
-def parse_expression3(text):
-    return parse_any(text, [
-        parse_string,
-        parse_float,
-        parse_int,
-        parse_range,
-        parse_ref,
-        parse_call,
-        parse_brace,
-    ])
-
-
-def parse_expression2(text):
-    lhs, tail = parse_expression3(text)
-    while True:
-        try:
-            m, tail = parse_re(tail, r'\s*[*/]\s*')
-        except ParseError:
-            break
-        rhs, tail = parse_expression3(tail)
-        lhs = m[0].strip(), lhs, rhs, m[0]
-    return lhs, tail
-
-
-def parse_expression(text):
-    lhs, tail = parse_expression2(text)
-    while True:
-        try:
-            m, tail = parse_re(tail, r'\s*[-+]\s*')
-        except ParseError:
-            break
-        rhs, tail = parse_expression2(tail)
-        lhs = m[0].strip(), lhs, rhs, m[0]
-    return lhs, tail
+def tokenize(text):
+    tokens = []
+    pos = 0
+    while pos < len(text):
+        m = TOKEN_RE.match(text, pos)
+        if not m:
+            raise ParseError(f'unexpected input: {text[pos:]}')
+        tokens.append((m.lastgroup, m))
+        pos = m.end()
+    tokens.append((None, None))
+    return tokens
+
+
+class Parser:
+    def __init__(self, text):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos][0]
+
+    def next(self, kind=None):
+        token, m = self.tokens[self.pos]
+        if kind and token != kind:
+            tail = self.text[m.start():] if m else ''
+            raise ParseError(f'expected {kind}: {tail}')
+        self.pos += 1
+        return token, m
+
+    def parse_ref(self, m):
+        x_fixed = bool(m['x_fixed'])
+        x = col2x(m['col'])
+        y_fixed = bool(m['y_fixed'])
+        y = int(m['row'], 10) - 1
+        return ('ref', (x, y), (x_fixed, y_fixed))
+
+    def parse_call(self, name):
+        self.next('lbrace')
+        args = []
+        commas = []
+        if self.peek() == 'rbrace':
+            self.next()
+            return (name, args, commas)
+        while True:
+            args.append(self.parse_expression())
+            if self.peek() == 'rbrace':
+                self.next()
+                return (name, args, commas)
+            _, c = self.next('comma')
+            commas.append(c[0])
+
+    def parse_operand(self):
+        token, m = self.next()
+        if token == 'str':
+            return ('str', m[0][1:-1], m[0])
+        elif token == 'float':
+            return ('float', float(m[0]), m[0])
+        elif token == 'int':
+            return ('int', int(m[0], 10), m[0])
+        elif token == 'ref':
+            ref = self.parse_ref(m)
+            if self.peek() == 'colon':
+                self.next()
+                _, m = self.next('ref')
+                return ('range', ref, self.parse_ref(m))
+            return ref
+        elif token == 'name':
+            return self.parse_call(m[0])
+        elif token == 'lbrace':
+            exp = self.parse_expression()
+            self.next('rbrace')
+            return ('brace', exp)
+        elif token == 'deleted':
+            raise RefError
+        else:
+            tail = self.text[m.start():] if m else ''
+            raise ParseError(f'expected operand: {tail}')
+
+    def parse_expression(self, precedence=1):
+        lhs = self.parse_operand()
+        while self.peek() == 'op':
+            _, m = self.tokens[self.pos]
+            op = m[0].strip()
+            if PRECEDENCE[op] < precedence:
+                break
+            self.next()
+            rhs = self.parse_expression(PRECEDENCE[op] + 1)
+            lhs = op, lhs, rhs, m[0]
+        return lhs
 
 
 def parse(text):
-    expr, tail = parse_expression(text)
-    if tail:
-        raise ParseError(f'unexpected tail: {tail}')
+    parser = Parser(text)
+    expr = parser.parse_expression()
+    if parser.peek() is not None:
+        _, m = parser.tokens[parser.pos]
+        raise ParseError(f'unexpected tail: {text[m.start():]}')
     return expr
 
 
@@ -143,6 +162,8 @@ def unparse(expr):
     if expr[0] in ['str', 'float', 'int']:
         return expr[2]
     elif expr[0] == 'ref':
+        if min(expr[1]) < 0:
+            return DELETED
         s = ''
         if expr[2][0]:
             s += '$'
@@ -152,6 +173,8 @@ def unparse(expr):
         s += str(expr[1][1] + 1)
         return s
     elif expr[0] == 'range':
+        if min(expr[1][1] + expr[2][1]) < 0:
+            return DELETED
         return unparse(expr[1]) + ':' + unparse(expr[2])
     elif expr[0] == 'brace':
         return '(' + unparse(expr[1]) + ')'
@@ -168,6 +191,30 @@ def unparse(expr):
         return f'{name}({sargs})'
 
 
+def unparse_parts(expr):
+    # like unparse(), but references are returned as nodes so that the text
+    # can be generated for different positions
+    if expr[0] in ['str', 'float', 'int']:
+        return [expr[2]]
+    elif expr[0] == 'ref':
+        return [expr]
+    elif expr[0] == 'range':
+        return [expr[1], ':', expr[2]]
+    elif expr[0] == 'brace':
+        return ['(', *unparse_parts(expr[1]), ')']
+    elif expr[0] in '+-*/':
+        return [*unparse_parts(expr[1]), expr[3], *unparse_parts(expr[2])]
+    else:
+        name, args, commas = expr
+        parts = [f'{name}(']
+        for i, arg in enumerate(args):
+            if i:
+                parts.append(commas[i - 1])
+            parts += unparse_parts(arg)
+        parts.append(')')
+        return parts
+
+
 def shift_refs(expr, d):
     if expr[0] == 'ref':
         x, y = expr[1]
@@ -176,7 +223,7 @@ def shift_refs(expr, d):
         if not expr[2][1]:
             y += d[1]
         return 'ref', (x, y), expr[2]
-    elif expr[0] in ['str', 'float', 'int']:
+    elif expr[0] in ['str', 'float', 'int', 'err']:
         return expr
     elif expr[0] == 'range':
         return 'range', shift_refs(expr[1], d), shift_refs(expr[2], d)
@@ -185,4 +232,69 @@ def shift_refs(expr, d):
     elif expr[0] in '+-*/':
         return expr[0], shift_refs(expr[1], d), shift_refs(expr[2], d), expr[3]
     else:
-        return expr[0], [shift_refs(arg, d) for arg in expr[1]], expr[2]
+        return expr[0], tuple(shift_refs(arg, d) for arg in expr[1]), tuple(expr[2])
+
+
+def iter_refs(expr):
+    if expr[0] in ['ref', 'range']:
+        yield expr
+    elif expr[0] in ['str', 'float', 'int', 'err']:
+        pass
+    elif expr[0] == 'brace':
+        yield from iter_refs(expr[1])
+    elif expr[0] in '+-*/':
+        yield from iter_refs(expr[1])
+        yield from iter_refs(expr[2])
+    else:
+        for arg in expr[1]:
+            yield from iter_refs(arg)
+
+
+def move_pos(pos, at, n):
+    # position after inserting n rows/columns before `at` or deleting -n
+    # rows/columns starting at `at`. Deleted positions become -1.
+    if pos < at:
+        return pos
+    elif pos >= at - min(n, 0):
+        return pos + n
+    return -1
+
+
+def move_ref(ref, axis, pos):
+    xy = list(ref[1])
+    xy[axis] = pos
+    return 'ref', tuple(xy), ref[2]
+
+
+def move_refs(expr, axis, at, n):
+    # like shift_refs(), but for inserting or deleting rows (axis 1) or
+    # columns (axis 0) in an expression with absolute references
+    if expr[0] == 'ref':
+        return move_ref(expr, axis, move_pos(expr[1][axis], at, n))
+    elif expr[0] in ['str', 'float', 'int', 'err']:
+        return expr
+    elif expr[0] == 'range':
+        _, ref1, ref2 = expr
+        pos1 = move_pos(ref1[1][axis], at, n)
+        pos2 = move_pos(ref2[1][axis], at, n)
+        # ranges shrink unless they are deleted completely
+        if pos1 < 0 and pos2 >= 0:
+            pos1 = at - 1 if ref1[1][axis] > ref2[1][axis] else at
+        elif pos2 < 0 and pos1 >= 0:
+            pos2 = at - 1 if ref2[1][axis] > ref1[1][axis] else at
+        return 'range', move_ref(ref1, axis, pos1), move_ref(ref2, axis, pos2)
+    elif expr[0] == 'brace':
+        return 'brace', move_refs(expr[1], axis, at, n)
+    elif expr[0] in '+-*/':
+        return (
+            expr[0],
+            move_refs(expr[1], axis, at, n),
+            move_refs(expr[2], axis, at, n),
+            expr[3],
+        )
+    else:
+        return (
+            expr[0],
+            tuple(move_refs(arg, axis, at, n) for arg in expr[1]),
+            tuple(expr[2]),
+        )
@@ -0,0 +1,96 @@
+from contextlib import contextmanager
+
+from .sheet import Formula
+
+
+class Move:
+    # inserting or deleting rows or columns, together with the previous
+    # state of the cells that were deleted or rewritten by it
+    def __init__(self, axis, at, n, cells=None):
+        self.axis = axis
+        self.at = at
+        self.n = n
+        self.cells = cells
+
+
+class History:
+    # Undo and redo only store the cells that were changed by an operation,
+    # together with the values that were invalidated by it. Restoring them
+    # takes time proportional to the operation, not to the sheet.
+    # Moves change the position of all later cells, so they are stored as
+    # operations. Entries on the stacks refer to the positions at the time
+    # they were recorded, which are restored by undoing later moves first.
+    def __init__(self, sheet):
+        self.sheet = sheet
+        self.undo_stack = []
+        self.redo_stack = []
+
+    @contextmanager
+    def record(self):
+        if self.sheet.journal is not None:
+            yield
+            return
+        self.sheet.journal = ({}, {})
+        try:
+            with self.sheet.batch():
+                yield
+        finally:
+            journal, self.sheet.journal = self.sheet.journal, None
+            if journal[0]:
+                self.undo_stack.append(journal)
+                self.redo_stack = []
+
+    def restore(self, journal):
+        cells, cache = journal
+        self.sheet.journal = ({}, {})
+        try:
+            with self.sheet.batch():
+                for cell, (raw, parsed) in cells.items():
+                    if isinstance(parsed, Formula):
+                        parsed = self.sheet.add_formula(parsed)
+                    self.sheet.set_parsed(cell, raw, parsed)
+        finally:
+            journal, self.sheet.journal = self.sheet.journal, None
+        # the sheet is in the same state as when these values were cached
+        for cell, value in cache.items():
+            self.sheet.cache[cell] = value
+        return journal
+
+    def move(self, axis, at, n):
+        self.undo_stack.append(self.apply(Move(axis, at, n)))
+        self.redo_stack = []
+
+    def apply(self, move: Move) -> Move:
+        self.sheet.journal = ({}, {})
+        try:
+            self.sheet.move(move.axis, move.at, move.n)
+        finally:
+            journal, self.sheet.journal = self.sheet.journal, None
+        return Move(move.axis, move.at, move.n, journal[0])
+
+    def revert(self, move: Move) -> Move:
+        # the inverse move restores all positions, but not deleted cells or
+        # references
+        self.sheet.move(move.axis, move.at, -move.n)
+        self.restore((move.cells, {}))
+        return Move(move.axis, move.at, move.n)
+
+    def undo(self) -> bool:
+        if not self.undo_stack:
+            return False
+        entry = self.undo_stack.pop()
+        if isinstance(entry, Move):
+            self.redo_stack.append(self.revert(entry))
+        else:
+            self.redo_stack.append(self.restore(entry))
+        return True
+
+    def redo(self) -> bool:
+        if not self.redo_stack:
+            return False
+        entry = self.redo_stack.pop()
+        if isinstance(entry, Move):
+            self.undo_stack.append(self.apply(entry))
+        else:
+            self.undo_stack.append(self.restore(entry))
+        return True
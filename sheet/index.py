@@ -0,0 +1,305 @@
+from bisect import bisect_left
+from bisect import bisect_right
+
+AGGREGATES = {
+    sum: 0,
+    min: float('inf'),
+    max: float('-inf'),
+}
+
+
+def iter_blocks(y1, y2):
+    # split rows y1..y2 into aligned blocks of size 2**k
+    y2 += 1
+    while y1 < y2:
+        k = (y2 - y1).bit_length() - 1
+        if y1:
+            k = min(k, (y1 & -y1).bit_length() - 1)
+        yield k, y1 >> k
+        y1 += 1 << k
+
+
+class RangeIndex:
+    def __init__(self):
+        self.blocks = {}
+        self.levels = {}
+
+    def add(self, x, y1, y2, item):
+        for k, b in iter_blocks(y1, y2):
+            block = self.blocks.setdefault((x, k, b), {})
+            block[item] = block.get(item, 0) + 1
+            self.levels[x] = max(self.levels.get(x, 0), k + 1)
+
+    def remove(self, x, y1, y2, item):
+        for k, b in iter_blocks(y1, y2):
+            block = self.blocks[x, k, b]
+            block[item] -= 1
+            if not block[item]:
+                del block[item]
+            if not block:
+                del self.blocks[x, k, b]
+
+    def get(self, cell, seen=None):
+        # blocks in `seen` are skipped, so callers that visit many cells
+        # get the items of every block only once
+        x, y = cell
+        for k in range(self.levels.get(x, 0)):
+            key = (x, k, y >> k)
+            if seen is not None:
+                if key in seen:
+                    continue
+                seen.add(key)
+            yield from self.blocks.get(key, ())
+
+
+class ColumnIndex:
+    # Segment trees over the numbers of a column. Empty cells count as 0.
+    # Formulas are added with their value once it is known (see set_value)
+    # and removed again when it is invalidated (see reset). All other cells
+    # are neutral in the trees and counted in `special` so they can be
+    # evaluated separately. Formulas without a value are also counted in
+    # `formulas` because they are the only dependencies that may still have
+    # to be calculated. All rows before `stop` are included, but the trees
+    # only reach to the last of them that is not empty (rounded up to a
+    # power of two), so tall ranges over few values stay small.
+    def __init__(self, cells: dict, stop):
+        self.size = 1
+        self.stop = 0
+        self.build({})
+        self.extend(cells, stop)
+
+    def extend(self, cells: dict, stop):
+        # include the rows up to `stop`. `cells` are the cells of the rows
+        # that were not included yet.
+        self.stop = max(self.stop, stop)
+        rows = max(cells, default=-1) + 1
+        if rows <= self.size:
+            self.update({y: get_leaf(value) for y, value in cells.items()})
+            return
+        leaves = self.get_leaves()
+        leaves.update((y, get_leaf(value)) for y, value in cells.items())
+        while self.size < rows:
+            self.size *= 2
+        self.build(leaves)
+
+    def build(self, leaves: dict):
+        # leaves are (number or None, special, formula)
+        self.trees = {}
+        for fn, neutral in AGGREGATES.items():
+            self.trees[fn] = make_tree(self.size, fn, {
+                y: neutral if number is None else number
+                for y, (number, _, _) in leaves.items()
+            })
+        self.special = make_tree(
+            self.size, sum, {y: leaf[1] for y, leaf in leaves.items()}
+        )
+        self.formulas = make_tree(
+            self.size, sum, {y: leaf[2] for y, leaf in leaves.items()}
+        )
+
+    def get_leaves(self) -> dict:
+        leaves = {}
+        for y in range(self.size):
+            i = self.size + y
+            special = self.special[i]
+            number = None if special else self.trees[sum][i]
+            leaves[y] = (number, special, self.formulas[i])
+        return leaves
+
+    def update(self, leaves: dict):
+        if len(leaves) > self.size // 16:
+            # rebuild the whole tree instead of walking up from every leaf
+            old = self.get_leaves()
+            old.update(leaves)
+            self.build(old)
+            return
+        for y, (number, special, formula) in leaves.items():
+            i = self.size + y
+            for fn, neutral in AGGREGATES.items():
+                update_tree(
+                    self.trees[fn], fn, i, neutral if number is None else number
+                )
+            update_tree(self.special, sum, i, special)
+            update_tree(self.formulas, sum, i, formula)
+
+    def set(self, y, value):
+        # the parsed value of a cell changed
+        if y < self.size:
+            self.update({y: get_leaf(value)})
+        elif y < self.stop and value is not None:
+            self.extend({y: value}, self.stop)
+
+    def set_value(self, y, value: float|int|None):
+        # the value of a formula was calculated. None means that the value
+        # is not a number.
+        if value is None:
+            self.update({y: (None, 1, 0)})
+        else:
+            self.update({y: (value, 0, 0)})
+
+    def is_calculated(self, y) -> bool:
+        return y < self.size and not self.formulas[self.size + y]
+
+    def reset(self, rows):
+        # the values of these formulas were invalidated
+        self.update({y: (None, 1, 1) for y in rows if y < self.size})
+
+    def query(self, fn, y1, y2):
+        tree = self.trees[fn]
+        left = []
+        right = []
+        lo = y1 + self.size
+        hi = min(y2, self.size - 1) + self.size + 1
+        while lo < hi:
+            if lo & 1:
+                left.append(tree[lo])
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                right.append(tree[hi])
+            lo //= 2
+            hi //= 2
+        if y2 >= self.size:
+            right.insert(0, 0)
+        return fn(left + right[::-1])
+
+    def find(self, fn, value, y1, y2) -> tuple[int, float|int]:
+        # the first row in y1..y2 that has `value` in the tree of min or max
+        # and the number in that row, which may be of another type
+        tree = self.trees[fn]
+        stack = [(1, 0, self.size - 1)]
+        while stack:
+            i, lo, hi = stack.pop()
+            # subtrees that cannot contain `value` are skipped
+            if fn((value, tree[i])) != tree[i] or hi < y1 or lo > y2:
+                continue
+            elif lo == hi:
+                if tree[i] == value:
+                    return lo, tree[i]
+            else:
+                mid = (lo + hi) // 2
+                stack.append((2 * i + 1, mid + 1, hi))
+                stack.append((2 * i, lo, mid))
+        # an empty row after the tree
+        return max(y1, self.size), 0
+
+    def iter_marked(self, tree, y1, y2):
+        # rows in y1..y2 that are counted in tree, in order. Only subtrees
+        # that contain such rows are visited.
+        stack = [(1, 0, self.size - 1)]
+        while stack:
+            i, lo, hi = stack.pop()
+            if not tree[i] or hi < y1 or lo > y2:
+                continue
+            elif lo == hi:
+                yield lo
+            else:
+                mid = (lo + hi) // 2
+                stack.append((2 * i + 1, mid + 1, hi))
+                stack.append((2 * i, lo, mid))
+
+    def iter_special(self, y1, y2):
+        return self.iter_marked(self.special, y1, y2)
+
+    def iter_formulas(self, y1, y2):
+        return self.iter_marked(self.formulas, y1, y2)
+
+
+def make_tree(size, fn, leaves: dict) -> list:
+    tree = [0] * (2 * size)
+    for y, leaf in leaves.items():
+        tree[size + y] = leaf
+    for i in range(size - 1, 0, -1):
+        tree[i] = fn((tree[2 * i], tree[2 * i + 1]))
+    return tree
+
+
+def update_tree(tree, fn, i, leaf):
+    if tree[i] is leaf:
+        return
+    tree[i] = leaf
+    while i > 1:
+        i //= 2
+        tree[i] = fn((tree[2 * i], tree[2 * i + 1]))
+
+
+def get_leaf(value) -> tuple:
+    # formulas start without a value
+    if value is None:
+        return (0, 0, 0)
+    elif isinstance(value, float|int):
+        return (value, 0, 0)
+    elif isinstance(value, str):
+        return (None, 1, 0)
+    else:
+        return (None, 1, 1)
+
+
+class LookupIndex:
+    # hash and sorted indexes over the keys of a range (in row-major order).
+    # Keys are numbers, lowercase strings or None for cells that never match.
+    def __init__(self, keys: list):
+        self.size = len(keys)
+        self.positions = {}
+        for i, key in enumerate(keys):
+            if key is not None:
+                self.positions.setdefault(key, []).append(i)
+        self.sorted = {}
+
+    def get_sorted(self, key) -> tuple[list, list]:
+        # keys of the same type as `key` in sorted order and their positions
+        kind = isinstance(key, str)
+        if kind not in self.sorted:
+            items = sorted(
+                (k, i)
+                for k, positions in self.positions.items()
+                if isinstance(k, str) == kind
+                for i in positions
+            )
+            self.sorted[kind] = ([k for k, _ in items], [i for _, i in items])
+        return self.sorted[kind]
+
+    def find(self, op, key) -> list[int]:
+        # positions of all keys for which `k op key` is true, in order
+        if op == '=':
+            return self.positions.get(key, [])
+        elif op == '<>':
+            other = set(self.positions.get(key, []))
+            return [i for i in range(self.size) if i not in other]
+        keys, positions = self.get_sorted(key)
+        if op == '<':
+            return sorted(positions[:bisect_left(keys, key)])
+        elif op == '<=':
+            return sorted(positions[:bisect_right(keys, key)])
+        elif op == '>':
+            return sorted(positions[bisect_right(keys, key):])
+        else:
+            return sorted(positions[bisect_left(keys, key):])
+
+    def count(self, op, key) -> int:
+        # same as len(self.find(op, key)), but without listing positions
+        if op == '=':
+            return len(self.positions.get(key, []))
+        elif op == '<>':
+            return self.size - len(self.positions.get(key, []))
+        keys, _ = self.get_sorted(key)
+        if op == '<':
+            return bisect_left(keys, key)
+        elif op == '<=':
+            return bisect_right(keys, key)
+        elif op == '>':
+            return len(keys) - bisect_right(keys, key)
+        else:
+            return len(keys) - bisect_left(keys, key)
+
+    def find_le(self, key) -> int|None:
+        # position of the largest key that is less than or equal to `key`
+        keys, positions = self.get_sorted(key)
+        i = bisect_right(keys, key)
+        return positions[i - 1] if i else None
+
+    def find_ge(self, key) -> int|None:
+        # position of the smallest key that is greater than or equal to `key`
+        keys, positions = self.get_sorted(key)
+        i = bisect_left(keys, key)
+        return positions[i] if i < len(keys) else None
@@ -0,0 +1,163 @@
+from bisect import bisect_left
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+
+from .sheet import Formula
+from .sheet import Sheet
+from .vector import vectorize
+
+MIN_CELLS = 10000
+
+
+class Components:
+    # union-find over formula cells
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, cell):
+        root = cell
+        while self.parent.get(root, root) != root:
+            root = self.parent[root]
+        while cell != root:
+            self.parent[cell], cell = root, self.parent[cell]
+        return root
+
+    def union(self, a, b):
+        a = self.find(a)
+        b = self.find(b)
+        if a != b:
+            self.parent[b] = a
+
+
+class Links:
+    # joins runs of formula cells in a column. Every pair of neighbours is
+    # joined at most once, so overlapping ranges do not cost more than the
+    # number of cells.
+    def __init__(self, rows):
+        self.rows = rows
+        self.next = list(range(len(rows)))
+
+    def skip(self, i):
+        root = i
+        while self.next[root] != root:
+            root = self.next[root]
+        while i != root:
+            self.next[i], i = root, self.next[i]
+        return root
+
+    def join(self, components, x, i, j):
+        i = self.skip(i)
+        while i < j:
+            components.union((x, self.rows[i]), (x, self.rows[i + 1]))
+            self.next[i] = i + 1
+            i = self.skip(i + 1)
+
+
+def evaluate_cells(exprs, inputs, cells):
+    # formulas are sent as relative expressions so they do not have to be
+    # parsed again. The sheet is only evaluated once, so there is no need
+    # for dependencies.
+    sheet = Sheet()
+    formulas = [Formula(expr, sheet.compile(expr)) for expr in exprs]
+    for cell, value in inputs:
+        if isinstance(value, tuple):
+            value = formulas[value[0]]
+        sheet.parsed[cell] = value
+    vectorize(sheet)
+    return [sheet.get_value(cell) for cell in cells]
+
+
+def get_inputs(sheet, refs, spans, encode):
+    # parsed values of the given cells and of all cells in the column spans
+    cells = set(refs)
+    columns = {}
+    for x, y1, y2 in spans:
+        columns.setdefault(x, []).append((y1, y2))
+    for x, intervals in columns.items():
+        intervals.sort()
+        y_end = -1
+        for y1, y2 in intervals:
+            for y in range(max(y1, y_end + 1), y2 + 1):
+                cells.add((x, y))
+            y_end = max(y_end, y2)
+    return [
+        (cell, encode(sheet.parsed[cell]))
+        for cell in cells
+        if cell in sheet.parsed
+    ]
+
+
+def evaluate_parallel(sheet, jobs) -> bool:
+    # evaluate independent groups of formulas in separate processes and
+    # store the results in the cache. Returns False if the sheet is too
+    # small or does not split into enough groups.
+    sheet.load_all()
+    formulas = [
+        cell for cell, parsed in sheet.parsed.items()
+        if isinstance(parsed, Formula)
+    ]
+    if len(formulas) < MIN_CELLS:
+        return False
+
+    columns = {}
+    for x, y in formulas:
+        columns.setdefault(x, []).append(y)
+    links = {x: Links(rows) for x, rows in columns.items()}
+
+    components = Components()
+    deps = {}
+    for cell in formulas:
+        refs, ranges = sheet.parsed[cell].get_deps(cell)
+        spans = [
+            (x, y1, y2) for x1, y1, x2, y2 in ranges for x in range(x1, x2 + 1)
+        ]
+        deps[cell] = refs, spans
+        for ref in refs:
+            if isinstance(sheet.parsed.get(ref), Formula):
+                components.union(cell, ref)
+        for x, y1, y2 in spans:
+            if x in columns:
+                i = bisect_left(columns[x], y1)
+                j = bisect_right(columns[x], y2) - 1
+                if i <= j:
+                    links[x].join(components, x, i, j)
+                    components.union(cell, (x, columns[x][i]))
+
+    groups = {}
+    for cell in formulas:
+        groups.setdefault(components.find(cell), []).append(cell)
+    groups = sorted(groups.values(), key=len, reverse=True)
+    if len(groups[0]) > len(formulas) // 2:
+        return False
+
+    buckets = [[] for _ in range(jobs * 4)]
+    for group in groups:
+        min(buckets, key=len).extend(group)
+
+    tasks = []
+    for bucket in buckets:
+        if not bucket:
+            continue
+        ids = {}
+        exprs = []
+
+        def encode(parsed):
+            if not isinstance(parsed, Formula):
+                return parsed
+            elif id(parsed) not in ids:
+                ids[id(parsed)] = len(exprs)
+                exprs.append(parsed.expr)
+            return (ids[id(parsed)],)
+
+        bucket.sort(key=lambda cell: (cell[1], cell[0]))
+        refs = [ref for cell in bucket for ref in deps[cell][0]]
+        spans = [span for cell in bucket for span in deps[cell][1]]
+        inputs = get_inputs(sheet, refs + bucket, spans, encode)
+        tasks.append((exprs, inputs, bucket))
+
+    with ProcessPoolExecutor(jobs) as executor:
+        futures = [executor.submit(evaluate_cells, *task) for task in tasks]
+        for (_, _, bucket), future in zip(tasks, futures):
+            for cell, value in zip(bucket, future.result()):
+                sheet.cache[cell] = value
+    return True
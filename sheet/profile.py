@@ -0,0 +1,142 @@
+import time
+
+from .expression import x2col
+from .sheet import Formula
+
+
+def format_cell(cell) -> str:
+    return f'{x2col(cell[0])}{cell[1] + 1}'
+
+
+class Profile:
+    # Counts and times the work done by a sheet. The methods of the sheet
+    # are only wrapped while profiling, so there is no overhead otherwise.
+    # Times of formulas include the formulas they calculate on the way.
+    def __init__(self, sheet):
+        self.sheet = sheet
+        self.evals = {}  # cell: [count, time]
+        self.parses = {}  # formula: [count, time, cell]
+        self.ranges = {}  # (name, cell1, cell2): [count, time]
+        self.hits = 0
+        self.misses = 0
+        self.formulas = set()
+
+        get_value = sheet.get_value
+        parse_relative = sheet.parse_relative
+        aggregate = sheet.aggregate
+        recompile = sheet.recompile
+
+        def profiled_get_value(cell):
+            if isinstance(sheet.parsed.get(cell), Formula):
+                if cell in sheet.cache:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            return get_value(cell)
+
+        def profiled_parse_relative(raw, cell):
+            start = time.perf_counter()
+            parsed = parse_relative(raw, cell)
+            if isinstance(parsed, Formula):
+                self.add(self.parses, parsed, start, cell)
+                self.wrap(parsed)
+            return parsed
+
+        def profiled_aggregate(fn, cell1, cell2):
+            start = time.perf_counter()
+            try:
+                return aggregate(fn, cell1, cell2)
+            finally:
+                self.add(self.ranges, (fn.__name__, cell1, cell2), start)
+
+        def profiled_recompile(formula):
+            recompile(formula)
+            self.formulas.discard(formula)
+            self.wrap(formula)
+
+        sheet.get_value = profiled_get_value
+        sheet.parse_relative = profiled_parse_relative
+        sheet.aggregate = profiled_aggregate
+        sheet.recompile = profiled_recompile
+
+        # compiled formulas still refer to the original get_value
+        for formula in list(sheet.formulas.values()):
+            formula.fn = sheet.compile(formula.expr)
+            self.wrap(formula)
+
+    def stop(self):
+        # the methods of the sheet are used again and formulas are compiled
+        # again, because they still refer to the wrapped get_value
+        for name in ['get_value', 'parse_relative', 'aggregate', 'recompile']:
+            delattr(self.sheet, name)
+        for formula in self.formulas | set(self.sheet.formulas.values()):
+            self.sheet.recompile(formula)
+        self.formulas = set()
+
+    def add(self, stats, key, start, *extra):
+        duration = time.perf_counter() - start
+        if key in stats:
+            stats[key][0] += 1
+            stats[key][1] += duration
+        else:
+            stats[key] = [1, duration, *extra]
+
+    def wrap(self, formula):
+        if formula in self.formulas:
+            return
+        self.formulas.add(formula)
+        fn = formula.fn
+
+        def profiled(cell):
+            start = time.perf_counter()
+            try:
+                return fn(cell)
+            finally:
+                self.add(self.evals, cell, start)
+
+        formula.fn = profiled
+
+    def summary(self) -> str:
+        count = sum(c for c, _ in self.evals.values())
+        duration = sum(t for _, t in self.evals.values())
+        lookups = self.hits + self.misses
+        hits = self.hits / lookups if lookups else 1
+        return f'{count} evals in {duration:.3f}s, {hits:.0%} cache hits'
+
+    def report(self, n=10) -> str:
+        lines = [self.summary()]
+        lines.append(f'cache: {self.hits} hits, {self.misses} misses')
+        other = sum(1 for cell in self.sheet.cache if cell not in self.evals)
+        if other:
+            lines.append(f'cache: {other} values calculated in bulk')
+        parse_time = sum(t for _, t, _ in self.parses.values())
+        lines.append(
+            f'parse: {len(self.parses)} formulas in {parse_time:.3f}s'
+        )
+
+        lines.append('')
+        lines.append('hottest cells:')
+        hottest = sorted(self.evals.items(), key=lambda i: i[1][1], reverse=True)
+        for cell, (count, duration) in hottest[:n]:
+            lines.append(
+                f'  {format_cell(cell):8} {count:6}x {duration:9.6f}s  '
+                f'{self.sheet.get_raw(cell)}'
+            )
+
+        lines.append('')
+        lines.append('most expensive ranges:')
+        ranges = sorted(self.ranges.items(), key=lambda i: i[1][1], reverse=True)
+        for (name, cell1, cell2), (count, duration) in ranges[:n]:
+            label = f'{name}({format_cell(cell1)}:{format_cell(cell2)})'
+            lines.append(f'  {label:20} {count:6}x {duration:9.6f}s')
+
+        lines.append('')
+        lines.append('slowest formulas to parse:')
+        parses = sorted(self.parses.items(), key=lambda i: i[1][1], reverse=True)
+        for formula, (count, duration, cell) in parses[:n]:
+            if formula.expr[0] == 'err':
+                text = repr(formula.expr[1])
+            else:
+                text = '=' + formula.unparse(cell)
+            lines.append(f'  {count:6}x {duration:9.6f}s  {text}')
+        return '\n'.join(lines)
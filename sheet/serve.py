@@ -0,0 +1,110 @@
+import asyncio
+import json
+import math
+
+from .csv import load_csv
+from .csv import to_display
+from .expression import parse
+from .sheet import iter_range
+
+
+def parse_cell(name) -> tuple[int, int]:
+    expr = parse(name)
+    if expr[0] != 'ref':
+        raise ValueError(name)
+    return expr[1]
+
+
+def to_json(value) -> float|int|str|None:
+    # JSON has no nan or infinity, so they are sent as strings like all
+    # other values that are not numbers
+    if isinstance(value, float) and not math.isfinite(value):
+        return to_display(value)
+    elif value is None or isinstance(value, float|int):
+        return value
+    return to_display(value)
+
+
+class Server:
+    # Keeps sheets in memory between requests, so only the cells that
+    # changed are calculated again. Requests are lines of JSON, e.g.
+    # {"cmd": "set", "sheet": "a.csv", "cells": {"A1": "=B1+1"}}. They run
+    # in threads. Requests for the same sheet wait for each other, requests
+    # for different sheets run concurrently.
+    def __init__(self):
+        self.sheets = {}
+        self.locks = {}
+
+    def get_sheet(self, path):
+        if path not in self.sheets:
+            self.sheets[path] = load_csv(path, lazy=True)
+        return self.sheets[path]
+
+    def close_sheet(self, path):
+        # the file of a lazily loaded sheet might still be open
+        sheet = self.sheets.pop(path, None)
+        if sheet is not None and sheet.source is not None:
+            sheet.source.close()
+
+    def run(self, request):
+        cmd = request['cmd']
+        path = request['sheet']
+        if cmd == 'load':
+            self.close_sheet(path)
+            self.sheets[path] = load_csv(path, lazy=True)
+            return None
+        elif cmd == 'close':
+            self.close_sheet(path)
+            return None
+        sheet = self.get_sheet(path)
+        if cmd == 'set':
+            with sheet.batch() as dirty:
+                for name, raw in request['cells'].items():
+                    sheet.set(parse_cell(name), raw)
+            return len(dirty)
+        elif cmd == 'get' and 'range' in request:
+            expr = parse(request['range'])
+            if expr[0] != 'range':
+                raise ValueError(request['range'])
+            cell1, cell2 = expr[1][1], expr[2][1]
+            width = abs(cell2[0] - cell1[0]) + 1
+            values = [
+                to_json(sheet.get_value(cell))
+                for cell in iter_range(cell1, cell2)
+            ]
+            return [values[i:i + width] for i in range(0, len(values), width)]
+        elif cmd == 'get':
+            return [
+                to_json(sheet.get_value(parse_cell(name)))
+                for name in request['cells']
+            ]
+        raise ValueError(cmd)
+
+    async def handle(self, reader, writer):
+        while line := await reader.readline():
+            try:
+                request = json.loads(line)
+                lock = self.locks.setdefault(request['sheet'], asyncio.Lock())
+                async with lock:
+                    result = await asyncio.to_thread(self.run, request)
+                response = {'result': result}
+            except Exception as err:
+                response = {'error': repr(err)}
+            writer.write(json.dumps(response).encode() + b'\n')
+            await writer.drain()
+        writer.close()
+
+    async def serve(self, address):
+        # a port on localhost or the path of a unix socket
+        if address.isdigit():
+            server = await asyncio.start_server(
+                self.handle, '127.0.0.1', int(address)
+            )
+        else:
+            server = await asyncio.start_unix_server(self.handle, address)
+        async with server:
+            await server.serve_forever()
+
+
+def serve(address):
+    asyncio.run(Server().serve(address))
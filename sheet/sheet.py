@@ -1,14 +1,28 @@
 import math
+import re
+from contextlib import contextmanager
 
 from .expression import ParseError
+from .expression import iter_refs
+from .expression import move_refs
 from .expression import parse
 from .expression import shift_refs
 from .expression import unparse
+from .expression import unparse_parts
+from .index import AGGREGATES
+from .index import ColumnIndex
+from .index import LookupIndex
+from .index import RangeIndex
+from .store import EMPTY
+from .store import CellStore
 
 BLOCKS = [' ', '▏', '▎', '▍', '▌', '▋', '▊', '▉', '█']
+CRITERION_RE = re.compile(r'(<=|>=|<>|<|>|=)?(.*)', re.DOTALL)
 
 
 class Bar:
+    __slots__ = ['value']
+
     def __init__(self, value):
         self.value = value
 
@@ -22,6 +36,94 @@ class Bar:
             return a * BLOCKS[-1] + BLOCKS[b] + (width - a - 1) * BLOCKS[0]
 
 
+def normalize(value) -> float|int|str|None:
+    # the key of a value in a LookupIndex
+    if isinstance(value, Bar):
+        value = value.value
+    if isinstance(value, str):
+        return value.lower()
+    elif isinstance(value, float|int):
+        return value
+    return None
+
+
+def parse_criterion(criterion) -> tuple[str, float|int|str|None]:
+    if isinstance(criterion, Exception):
+        raise criterion
+    elif not isinstance(criterion, str):
+        return '=', normalize(criterion)
+    op, text = CRITERION_RE.fullmatch(criterion).groups()
+    for t in [int, float]:
+        try:
+            return op or '=', t(text)
+        except ValueError:
+            pass
+    return op or '=', text.lower()
+
+
+def find_position(index: LookupIndex, key, kind) -> int:
+    # kind 0 is an exact match, 1 the largest value that is less than or
+    # equal to key, -1 the smallest value that is greater than or equal
+    if isinstance(key, Exception):
+        raise key
+    key = normalize(key)
+    i = None
+    if key is None:
+        pass
+    elif kind == 0:
+        i = next(iter(index.find('=', key)), None)
+    elif kind > 0:
+        i = index.find_le(key)
+    else:
+        i = index.find_ge(key)
+    if i is None:
+        raise KeyError(key)
+    return i
+
+
+def vlookup(sheet, key, rng, col, approx=1):
+    (x1, y1), (x2, y2) = rng
+    col = to_number(col)
+    if not 1 <= col <= x2 - x1 + 1:
+        raise IndexError(col)
+    index = sheet.get_lookup(x1, y1, x1, y2)
+    i = find_position(index, key, 1 if to_number(approx) else 0)
+    return sheet.get_value((x1 + int(col) - 1, y1 + i))
+
+
+def match(sheet, key, rng, kind=1):
+    (x1, y1), (x2, y2) = rng
+    if x1 != x2 and y1 != y2:
+        raise ValueError(rng)
+    index = sheet.get_lookup(x1, y1, x2, y2)
+    return find_position(index, key, to_number(kind)) + 1
+
+
+def countif(sheet, rng, criterion):
+    (x1, y1), (x2, y2) = rng
+    index = sheet.get_lookup(x1, y1, x2, y2)
+    return index.count(*parse_criterion(criterion))
+
+
+def sumif(sheet, rng, criterion, sum_rng=None):
+    (x1, y1), (x2, y2) = rng
+    if sum_rng is None:
+        sum_rng = rng
+    (sx1, sy1), (sx2, sy2) = sum_rng
+    if (sx2 - sx1, sy2 - sy1) != (x2 - x1, y2 - y1):
+        raise ValueError(sum_rng)
+    index = sheet.get_lookup(x1, y1, x2, y2)
+    total = 0
+    for i in index.find(*parse_criterion(criterion)):
+        dy, dx = divmod(i, x2 - x1 + 1)
+        value = sheet.get_value((sx1 + dx, sy1 + dy))
+        if isinstance(value, Bar):
+            value = value.value
+        if isinstance(value, float|int):
+            total += value
+    return total
+
+
 FUNCTIONS = {
     'sum': (sum, 'range'),
     'min': (min, 'range'),
@@ -33,9 +135,18 @@ FUNCTIONS = {
     'tan': (math.tan, 1),
     'log': (math.log, 1),
     'bar': (Bar, 1),
+    'vlookup': (vlookup, 'lookup'),
+    'match': (match, 'lookup'),
+    'countif': (countif, 'lookup'),
+    'sumif': (sumif, 'lookup'),
 }
 
 
+def sort_corners(cell1, cell2) -> tuple[tuple[int, int], tuple[int, int]]:
+    (x1, y1), (x2, y2) = cell1, cell2
+    return (min(x1, x2), min(y1, y2)), (max(x1, x2), max(y1, y2))
+
+
 def iter_range(cell1, cell2):
     x1, y1 = cell1
     x2, y2 = cell2
@@ -48,6 +159,106 @@ def iter_range(cell1, cell2):
             yield x, y
 
 
+def resolve(ref: tuple, cell) -> tuple[int, int]:
+    (x, y), (x_fixed, y_fixed) = ref[1], ref[2]
+    if not x_fixed:
+        x += cell[0]
+    if not y_fixed:
+        y += cell[1]
+    return x, y
+
+
+def iter_columns(ranges):
+    return {
+        (x, y1, y2)
+        for x1, y1, x2, y2 in ranges
+        for x in range(x1, x2 + 1)
+    }
+
+
+def iter_endpoints(refs):
+    # single references and both ends of ranges
+    for ref in refs:
+        if ref[0] == 'range':
+            yield ref[1]
+            yield ref[2]
+        else:
+            yield ref
+
+
+def get_span(formula, axis) -> tuple[int, int, int]:
+    # the lowest and highest relative positions (including the cell itself)
+    # and the highest fixed position that is referenced by a formula
+    lo = hi = 0
+    fixed = -1
+    for ref in iter_endpoints(formula.refs):
+        if ref[2][axis]:
+            fixed = max(fixed, ref[1][axis])
+        else:
+            lo = min(lo, ref[1][axis])
+            hi = max(hi, ref[1][axis])
+    return lo, hi, fixed
+
+
+def is_fixed(expr: tuple) -> bool:
+    # whether the expression has the same value in every cell
+    if expr[0] == 'ref':
+        return expr[2] == (True, True)
+    elif expr[0] == 'range':
+        return is_fixed(expr[1]) and is_fixed(expr[2])
+    elif expr[0] in ['int', 'float', 'str']:
+        return True
+    elif expr[0] == 'err':
+        return False
+    elif expr[0] == 'brace':
+        return is_fixed(expr[1])
+    elif expr[0] in '+-*/':
+        return is_fixed(expr[1]) and is_fixed(expr[2])
+    # lookups can succeed on values that are still part of a cycle
+    _, nargs = FUNCTIONS.get(expr[0].lower(), (None, None))
+    return nargs not in [None, 'lookup'] and all(is_fixed(a) for a in expr[1])
+
+
+def get_template(expr: tuple) -> tuple|None:
+    # the expression without the positions of its references, or None if
+    # its value must not be shared (see is_fixed)
+    if expr[0] in ['ref', 'range']:
+        return (expr[0],)
+    elif expr[0] in ['int', 'float', 'str']:
+        return expr
+    elif expr[0] == 'err':
+        return None
+    elif expr[0] == 'brace':
+        return get_template(expr[1])
+    elif expr[0] in '+-*/':
+        parts = (get_template(expr[1]), get_template(expr[2]))
+    else:
+        _, nargs = FUNCTIONS.get(expr[0].lower(), (None, None))
+        if nargs in [None, 'lookup']:
+            return None
+        parts = tuple(get_template(arg) for arg in expr[1])
+    if None in parts:
+        return None
+    return (expr[0].lower(), *parts)
+
+
+def iter_templates(expr: tuple):
+    # templates of the parts of the expression that can be shared by
+    # compile_common
+    if expr[0] == 'brace':
+        yield from iter_templates(expr[1])
+        return
+    elif expr[0] in ['int', 'float', 'str', 'ref', 'range', 'err']:
+        return
+    elif is_fixed(expr):
+        return
+    template = get_template(expr)
+    if template is not None:
+        yield template
+    for arg in expr[1:3] if expr[0] in '+-*/' else expr[1]:
+        yield from iter_templates(arg)
+
+
 def to_number(value: float|int|str|Bar|None|Exception) -> float|int:
     if isinstance(value, float):
         return value
@@ -63,11 +274,93 @@ def to_number(value: float|int|str|Bar|None|Exception) -> float|int:
         raise value
 
 
+def get_number(value) -> float|int|None:
+    # like to_number(), but None for values that are not numbers
+    if isinstance(value, float|int):
+        return value
+    elif isinstance(value, Bar):
+        return value.value
+    elif value is None:
+        return 0
+    return None
+
+
+class Formula:
+    # references are stored relative to the cell that contains the formula,
+    # so all cells of a filled region can share a single instance
+    def __init__(self, expr: tuple, fn):
+        self.expr = expr
+        self.fn = fn
+        self.refs = list(iter_refs(expr))
+        # ranges that are the same in every cell, see Sheet.calculate
+        self.fixed_ranges = [
+            sum(sort_corners(ref[1][1], ref[2][1]), ())
+            for ref in self.refs
+            if ref[0] == 'range' and is_fixed(ref)
+        ]
+        self.count = 0
+        if expr[0] != 'err':
+            self.parts = unparse_parts(expr)
+
+    def unparse(self, cell) -> str:
+        text = ''
+        for part in self.parts:
+            if isinstance(part, str):
+                text += part
+            else:
+                text += unparse(('ref', resolve(part, cell), part[2]))
+        return text
+
+    def get_deps(self, cell) -> tuple[list, list]:
+        refs = []
+        ranges = []
+        for ref in self.refs:
+            if ref[0] == 'ref':
+                refs.append(resolve(ref, cell))
+            else:
+                x1, y1 = resolve(ref[1], cell)
+                x2, y2 = resolve(ref[2], cell)
+                x1, x2 = sorted((x1, x2))
+                y1, y2 = sorted((y1, y2))
+                ranges.append((x1, y1, x2, y2))
+        return list(dict.fromkeys(refs)), ranges
+
+
+def is_canonical(raw: str, parsed: Formula|float|int|str) -> bool:
+    if isinstance(parsed, Formula):
+        return parsed.expr[0] != 'err'
+    return str(parsed) == raw
+
+
 class Sheet:
     def __init__(self):
-        self.raw = {}
-        self.parsed = {}
-        self.cache = {}
+        # raw text is only stored if it cannot be restored from parsed
+        self.raw = CellStore()
+        self.parsed = CellStore()
+        self.cache = CellStore()
+        self.formulas = {}
+        self.rdeps = CellStore()
+        self.range_deps = RangeIndex()
+        self.index = {}
+        # if set, the number of rows of all indexes, see get_index
+        self.max_index = None
+        self.lookups = {}
+        # values of expressions with only fixed references, see compile_fixed,
+        # and of other expressions by their absolute references, see
+        # compile_common
+        self.shared = {}
+        # formulas that contain expressions with relative references, by
+        # the template of the expression, see add_templates
+        self.templates = {}
+        # fixed ranges that only contain calculated formulas
+        self.calculated = set()
+        self.changed = None
+        self.source = None
+        # if set, all invalidated cells are added to it (e.g. for rendering)
+        self.dirty = None
+        # if set, a pair of dicts that collect the previous (raw, parsed) of
+        # changed cells and the previous values of invalidated cells
+        self.journal = None
 
     def parse(self, raw: str) -> tuple|float|int|str:
         if raw.startswith('='):
@@ -91,15 +384,21 @@ class Sheet:
         fn, nargs = FUNCTIONS[name.lower()]
         if nargs == 'range':
             if len(args) != 1 or args[0][0] != 'range':
-                raise ValueError(args)
+                raise ValueError(list(args))
             _, ref1, ref2 = args[0]
             return fn(
                 to_number(self.get_value(ref))
                 for ref in iter_range(ref1[1], ref2[1])
             )
+        elif nargs == 'lookup':
+            return fn(self, *[
+                sort_corners(a[1][1], a[2][1]) if a[0] == 'range'
+                else self.evaluate(a)
+                for a in args
+            ])
         else:
             if len(args) != nargs:
-                raise ValueError(args)
+                raise ValueError(list(args))
             return fn(*[to_number(self.evaluate(a)) for a in args])
 
     def evaluate(self, expr: tuple) -> float|int|str|Bar:
@@ -130,38 +429,564 @@ class Sheet:
         else:
             return self.call_function(*expr)
 
-    def set(self, cell, raw: str):
+    def parse_relative(self, raw: str, cell) -> Formula|float|int|str:
+        parsed = self.parse(raw)
+        if not isinstance(parsed, tuple):
+            return parsed
+        return self.get_formula(shift_refs(parsed, (-cell[0], -cell[1])))
+
+    def get_formula(self, expr: tuple) -> Formula:
+        if expr not in self.formulas:
+            self.add_templates(expr)
+            self.formulas[expr] = Formula(expr, self.compile(expr))
+        return self.formulas[expr]
+
+    def add_formula(self, formula: Formula) -> Formula:
+        # formulas that were removed (e.g. in the undo history) are used
+        # again unless there is a new one with the same expression
+        if formula.expr not in self.formulas:
+            self.add_templates(formula.expr)
+            self.formulas[formula.expr] = formula
+            self.recompile(formula)
+        return self.formulas[formula.expr]
+
+    def add_templates(self, expr: tuple):
+        # formulas are compiled again when one of their expressions gets a
+        # template in common with another formula, so they share its value
+        common = set()
+        for template in set(iter_templates(expr)):
+            exprs = self.templates.setdefault(template, set())
+            exprs.add(expr)
+            if len(exprs) == 2:
+                common.update(exprs)
+        for other in common:
+            if other in self.formulas:
+                self.recompile(self.formulas[other])
+
+    def remove_templates(self, expr: tuple):
+        for template in set(iter_templates(expr)):
+            exprs = self.templates[template]
+            exprs.discard(expr)
+            if not exprs:
+                del self.templates[template]
+
+    def recompile(self, formula: Formula):
+        formula.fn = self.compile(formula.expr)
+
+    def compile_function(self, name: str, args: list[tuple], commas: list[str]):
+        fn, nargs = FUNCTIONS.get(name.lower(), (None, None))
+        if nargs == 'range' and len(args) == 1 and args[0][0] == 'range':
+            _, ref1, ref2 = args[0]
+            if fn in AGGREGATES:
+                return lambda cell: self.aggregate(
+                    fn, resolve(ref1, cell), resolve(ref2, cell)
+                )
+            get_value = self.get_value
+            return lambda cell: fn(
+                to_number(get_value(c))
+                for c in iter_range(resolve(ref1, cell), resolve(ref2, cell))
+            )
+        elif nargs == 'lookup':
+            compiled = [self.compile_arg(arg) for arg in args]
+            return lambda cell: fn(self, *[c(cell) for c in compiled])
+        elif nargs == 1 and len(args) == 1:
+            arg = self.compile_number(args[0])
+            return lambda cell: fn(arg(cell))
+        elif nargs != 'range' and nargs == len(args):
+            compiled = [self.compile_number(arg) for arg in args]
+            return lambda cell: fn(*[c(cell) for c in compiled])
+        else:
+            expr = (name, args, commas)
+            return lambda cell: self.evaluate(shift_refs(expr, cell))
+
+    def compile_arg(self, expr: tuple):
+        # ranges are passed as sorted corners
+        if expr[0] == 'range':
+            _, ref1, ref2 = expr
+            return lambda cell: sort_corners(
+                resolve(ref1, cell), resolve(ref2, cell)
+            )
+        return self.compile(expr)
+
+    def compile_number(self, expr: tuple):
+        if expr[0] in ['int', 'float']:
+            value = expr[1]
+            return lambda cell: value
+        elif expr[0] == 'brace':
+            return self.compile_number(expr[1])
+        elif expr[0] in '+-*/':
+            return self.compile(expr)
+        else:
+            fn = self.compile(expr)
+            return lambda cell: to_number(fn(cell))
+
+    def compile_ref(self, expr: tuple):
+        (x, y), (x_fixed, y_fixed) = expr[1], expr[2]
+        get_value = self.get_value
+        if x_fixed and y_fixed:
+            return lambda cell: get_value((x, y))
+        elif x_fixed:
+            return lambda cell: get_value((x, cell[1] + y))
+        elif y_fixed:
+            return lambda cell: get_value((cell[0] + x, y))
+        else:
+            return lambda cell: get_value((cell[0] + x, cell[1] + y))
+
+    def compile(self, expr: tuple):
+        if expr[0] in ['int', 'float', 'str']:
+            value = expr[1]
+            return lambda cell: value
+        elif expr[0] == 'ref':
+            return self.compile_ref(expr)
+        elif expr[0] == 'brace':
+            return self.compile(expr[1])
+        elif expr[0] == 'err':
+            return lambda cell: self.evaluate(expr)
+        elif is_fixed(expr):
+            return self.compile_fixed(expr)
+        template = get_template(expr)
+        if len(self.templates.get(template, ())) < 2:
+            return self.compile_operation(expr)
+        return self.compile_common(expr, template)
+
+    def compile_fixed(self, expr: tuple):
+        # Constant expressions are calculated once. Others are calculated
+        # once until the next invalidation and then shared by all cells that
+        # contain them. Errors are not shared, so cycles are still detected.
+        if not any(iter_refs(expr)):
+            try:
+                value = self.evaluate(expr)
+            except Exception:
+                pass
+            else:
+                return lambda cell: value
+        fn = self.compile_operation(expr)
+        shared = self.shared
+
+        def compiled(cell):
+            value = shared.get(expr, EMPTY)
+            if value is EMPTY:
+                value = shared[expr] = fn(cell)
+            return value
+
+        return compiled
+
+    def compile_common(self, expr: tuple, template: tuple):
+        # Expressions with relative references have the same value in all
+        # cells where they resolve to the same cells, e.g. A1*A1 in B1 and
+        # in C1. This is only used for expressions whose template is part
+        # of more than one formula. Values are shared like in compile_fixed.
+        fn = self.compile_operation(expr)
+        refs = list(iter_endpoints(iter_refs(expr)))
+        shared = self.shared
+
+        def compiled(cell):
+            key = (template, *[resolve(ref, cell) for ref in refs])
+            value = shared.get(key, EMPTY)
+            if value is EMPTY:
+                value = shared[key] = fn(cell)
+            return value
+
+        return compiled
+
+    def compile_operation(self, expr: tuple):
+        if expr[0] in '+-*/':
+            lhs = self.compile_number(expr[1])
+            rhs = self.compile_number(expr[2])
+            if expr[0] == '+':
+                return lambda cell: lhs(cell) + rhs(cell)
+            elif expr[0] == '-':
+                return lambda cell: lhs(cell) - rhs(cell)
+            elif expr[0] == '*':
+                return lambda cell: lhs(cell) * rhs(cell)
+            else:
+                return lambda cell: lhs(cell) / rhs(cell)
+        else:
+            return self.compile_function(*expr)
+
+    def get_index(self, x, y) -> ColumnIndex:
+        # Indexes are only built for the columns that are used by ranges and
+        # only up to the last row that is used. With `max_index`, the least
+        # recently used indexes are dropped and built again when they are
+        # needed.
+        index = self.index.get(x)
+        if index is None:
+            cells = dict(self.parsed.iter_column(x, stop=y + 1))
+            index = self.index[x] = ColumnIndex(cells, y + 1)
+        elif index.stop <= y:
+            cells = dict(self.parsed.iter_column(x, index.stop, y + 1))
+            index.extend(cells, y + 1)
+        if self.max_index is not None:
+            self.index[x] = self.index.pop(x)
+            while len(self.index) > 1 and sum(
+                i.size for i in self.index.values()
+            ) > self.max_index:
+                del self.index[next(iter(self.index))]
+        return index
+
+    def get_lookup(self, x1, y1, x2, y2) -> LookupIndex:
+        # indexes are kept until a value in their range is invalidated
+        rect = (x1, y1, x2, y2)
+        index = self.lookups.get(x1, {}).get(rect)
+        if index is None:
+            for x in range(x1, x2 + 1):
+                self.load_range(x, y1, y2)
+            values = [self.get_value(c) for c in iter_range((x1, y1), (x2, y2))]
+            index = LookupIndex([normalize(value) for value in values])
+            # values in a cycle may still change
+            if not any(isinstance(value, ReferenceError) for value in values):
+                for x in range(x1, x2 + 1):
+                    self.lookups.setdefault(x, {})[rect] = index
+        return index
+
+    def drop_lookups(self, cells):
+        for x, y in cells:
+            rects = self.lookups.get(x)
+            if rects:
+                for rect in [r for r in rects if r[1] <= y <= r[3]]:
+                    for x_ in range(rect[0], rect[2] + 1):
+                        self.lookups[x_].pop(rect, None)
+
+    def aggregate(self, fn, cell1, cell2) -> float|int:
+        (x1, y1), (x2, y2) = cell1, cell2
+        x1, x2 = sorted((x1, x2))
+        y1, y2 = sorted((y1, y2))
+        indexes = {}
+        special = []
+        for x in range(x1, x2 + 1):
+            self.load_range(x, y1, y2)
+            indexes[x] = self.get_index(x, y2)
+            special += [(y, x) for y in indexes[x].iter_special(y1, y2)]
+        # formulas are added to the index once they are calculated, all
+        # other special cells raise
+        for y, x in sorted(special):
+            value = to_number(self.get_value((x, y)))
+            indexes[x].set_value(y, value)
+        results = {x: index.query(fn, y1, y2) for x, index in indexes.items()}
+        value = fn(results.values())
+        ties = [x for x, result in results.items() if result == value]
+        if fn is not sum and len(ties) > 1:
+            # equal numbers like 0 and 0.0 are picked in row-major order,
+            # like min() and max() over all cells would
+            found = {x: indexes[x].find(fn, value, y1, y2) for x in ties}
+            x = min(ties, key=lambda x: (found[x][0], x))
+            value = found[x][1]
+        return value
+
+    def add_deps(self, cell, formula: Formula):
+        refs, ranges = formula.get_deps(cell)
+        for ref in refs:
+            # a single dependent is stored without wrapping it in a set
+            deps = self.rdeps.get(ref)
+            if deps is None:
+                self.rdeps[ref] = cell
+            elif isinstance(deps, set):
+                deps.add(cell)
+                # the store might not hold the set itself
+                self.rdeps[ref] = deps
+            elif deps != cell:
+                self.rdeps[ref] = {deps, cell}
+        for x, y1, y2 in iter_columns(ranges):
+            self.range_deps.add(x, y1, y2, cell)
+
+    def remove_deps(self, cell, formula: Formula):
+        refs, ranges = formula.get_deps(cell)
+        for ref in refs:
+            deps = self.rdeps[ref]
+            if isinstance(deps, set):
+                deps.discard(cell)
+                self.rdeps[ref] = deps.pop() if len(deps) == 1 else deps
+            else:
+                del self.rdeps[ref]
+        for x, y1, y2 in iter_columns(ranges):
+            self.range_deps.remove(x, y1, y2, cell)
+
+    def get_dependents(self, cells) -> set:
+        dirty = set()
+        seen = set()
+        stack = list(cells)
+        while stack:
+            cell = stack.pop()
+            if cell in dirty:
+                continue
+            dirty.add(cell)
+            deps = self.rdeps.get(cell)
+            if isinstance(deps, set):
+                stack.extend(deps)
+            elif deps is not None:
+                stack.append(deps)
+            stack.extend(self.range_deps.get(cell, seen))
+        return dirty
+
+    def load(self, cell) -> Formula|float|int|str|None:
+        # cells from a lazy source are parsed when they are first needed
+        parsed = self.parsed.get(cell)
+        if parsed is None and self.source is not None:
+            raw = self.source.pop(cell)
+            if raw:
+                parsed = self.parse_relative(raw, cell)
+                self.put(cell, raw, parsed)
+            if self.source.is_empty():
+                self.source = None
+        return parsed
+
+    def load_range(self, x, y1, y2):
+        if self.source is not None:
+            for y, raw in self.source.pop_range(x, y1, y2):
+                self.put((x, y), raw, self.parse_relative(raw, (x, y)))
+
+    def load_all(self):
+        if self.source is not None:
+            for cell, raw in self.source.pop_all():
+                self.put(cell, raw, self.parse_relative(raw, cell))
+            self.source = None
+
+    def put(self, cell, raw: str, parsed: Formula|float|int|str):
+        old = self.parsed.get(cell)
         if raw:
-            self.raw[cell] = raw
-            self.parsed[cell] = self.parse(raw)
-            x, y = cell
-        elif cell in self.raw:
-            del self.raw[cell]
+            if is_canonical(raw, parsed):
+                self.raw.pop(cell, None)
+            else:
+                self.raw[cell] = raw
+            self.parsed[cell] = parsed
+        elif cell in self.parsed:
+            self.raw.pop(cell, None)
             del self.parsed[cell]
-        self.cache = {}
+        index = self.index.get(cell[0])
+        if index is not None:
+            index.set(cell[1], parsed if raw else None)
+        if raw and isinstance(parsed, Formula):
+            parsed.count += 1
+        if isinstance(old, Formula):
+            self.remove_deps(cell, old)
+            old.count -= 1
+            if not old.count and self.formulas.get(old.expr) is old:
+                del self.formulas[old.expr]
+                self.remove_templates(old.expr)
+        if raw and isinstance(parsed, Formula):
+            self.add_deps(cell, parsed)
 
-    def set_shifted(self, cell, raw: str, shift) -> str:
-        if raw.startswith('='):
-            expr = self.parse(raw)
-            shifted = shift_refs(expr, shift)
-            raw = '=' + unparse(shifted)
-        self.set(cell, raw)
+    def record(self, cell):
+        if self.journal is not None and cell not in self.journal[0]:
+            self.journal[0][cell] = (self.get_raw(cell), self.parsed.get(cell))
+
+    def set_parsed(self, cell, raw: str, parsed: Formula|float|int|str) -> set:
+        self.record(cell)
+        if self.source is not None:
+            self.source.pop(cell)
+        self.put(cell, raw, parsed)
+        if self.changed is not None:
+            self.changed.add(cell)
+            return set()
+        return self.invalidate([cell])
+
+    def invalidate(self, cells) -> set:
+        self.shared.clear()
+        self.calculated.clear()
+        dirty = self.get_dependents(cells)
+        if self.dirty is not None:
+            self.dirty.update(dirty)
+        if self.lookups:
+            self.drop_lookups(dirty)
+        for cell in dirty:
+            if self.journal is not None and cell in self.cache:
+                self.journal[1].setdefault(cell, self.cache[cell])
+            self.cache.pop(cell, None)
+        if self.index:
+            self.reset_index(dirty)
+        return dirty
+
+    def reset_index(self, cells):
+        # remove the values of invalidated formulas from the index
+        rows = {}
+        for x, y in cells:
+            index = self.index.get(x)
+            if (
+                index is not None
+                and index.is_calculated(y)
+                and isinstance(self.parsed.get((x, y)), Formula)
+            ):
+                rows.setdefault(x, []).append(y)
+        for x, ys in rows.items():
+            self.index[x].reset(ys)
+
+    @contextmanager
+    def batch(self):
+        # defer invalidation until all changes are applied. Values are not
+        # updated before the end of the batch. The yielded set is filled
+        # with the dirty cells at the end.
+        dirty = set()
+        if self.changed is not None:
+            yield dirty
+            return
+        self.changed = set()
+        try:
+            yield dirty
+        finally:
+            changed, self.changed = self.changed, None
+            dirty.update(self.invalidate(changed))
+
+    def set(self, cell, raw: str) -> set:
+        return self.set_parsed(cell, raw, self.parse_relative(raw, cell))
+
+    def set_shifted(self, cell, raw: str, shift) -> set:
+        source = (cell[0] - shift[0], cell[1] - shift[1])
+        if raw and self.get_raw(source) == raw:
+            parsed = self.parsed[source]
+        else:
+            parsed = self.parse_relative(raw, source)
+        if isinstance(parsed, Formula) and parsed.expr[0] != 'err':
+            raw = '=' + parsed.unparse(cell)
+            refs, ranges = parsed.get_deps(cell)
+            if any(min(ref) < 0 for ref in refs + ranges):
+                parsed = self.parse_relative(raw, cell)
+        return self.set_parsed(cell, raw, parsed)
+
+    def move(self, axis, at, n) -> set:
+        # Insert n rows (axis 1) or columns (axis 0) before `at`, or delete
+        # -n of them starting at `at`. Formulas are stored relative to their
+        # cell, so they only have to be rewritten if they reference a fixed
+        # position after `at` or if `at` is between them and a reference.
+        # Values stay valid unless they depend on deleted cells or on a range
+        # that got larger or smaller.
+        self.load_all()
+        self.index = {}
+        self.lookups = {}
+        end = at - min(n, 0)
+        spans = {}
+        rewrites = []
+        ranged = []
+        changed = []
+        # cells are only removed while iterating, which does not affect it
+        for cell, parsed in self.parsed.items():
+            pos = cell[axis]
+            if at <= pos < end:
+                self.record(cell)
+                self.put(cell, '', None)
+                self.cache.pop(cell, None)
+                continue
+            elif not isinstance(parsed, Formula):
+                continue
+            if parsed not in spans:
+                has_ranges = any(ref[0] == 'range' for ref in parsed.refs)
+                spans[parsed] = (*get_span(parsed, axis), has_ranges)
+            lo, hi, fixed, has_ranges = spans[parsed]
+            if has_ranges:
+                _, ranges = parsed.get_deps(cell)
+                if any(r[axis] < end and r[axis + 2] >= at for r in ranges):
+                    changed.append(cell)
+            if fixed >= at or (pos + lo < end and pos + hi >= at):
+                rewrites.append((cell, shift_refs(parsed.expr, cell)))
+                self.record(cell)
+                self.put(cell, '', None)
+            elif has_ranges:
+                ranged.append(cell)
+
+        dx, dy = (n, 0) if axis == 0 else (0, n)
+
+        def move_cell(cell):
+            if cell[axis] < at:
+                return cell
+            return cell[0] + dx, cell[1] + dy
+
+        for store in [self.raw, self.parsed, self.cache, self.rdeps]:
+            store.move(axis, at, n)
+        for cell, deps in self.rdeps.items():
+            if isinstance(deps, set):
+                self.rdeps[cell] = {
+                    (x + dx, y + dy) if (x, y)[axis] >= at else (x, y)
+                    for x, y in deps
+                }
+            elif deps[axis] >= at:
+                self.rdeps[cell] = (deps[0] + dx, deps[1] + dy)
+        self.range_deps = RangeIndex()
+        for cell in ranged:
+            cell = move_cell(cell)
+            _, ranges = self.parsed[cell].get_deps(cell)
+            for x, y1, y2 in iter_columns(ranges):
+                self.range_deps.add(x, y1, y2, cell)
+
+        changed = {move_cell(cell) for cell in changed}
+        for cell, expr in rewrites:
+            cell = move_cell(cell)
+            expr = move_refs(expr, axis, at, n)
+            if any(min(ref[1]) < 0 for ref in iter_endpoints(iter_refs(expr))):
+                # references to deleted cells are replaced by DELETED
+                raw = '=' + unparse(expr)
+                parsed = self.parse_relative(raw, cell)
+                changed.add(cell)
+            else:
+                parsed = self.get_formula(shift_refs(expr, (-cell[0], -cell[1])))
+                raw = '=' + parsed.unparse(cell)
+            self.put(cell, raw, parsed)
+        return self.invalidate(changed)
 
     def get_raw(self, cell) -> str:
-        return self.raw.get(cell, '')
+        parsed = self.load(cell)
+        if cell in self.raw:
+            return self.raw[cell]
+        if parsed is None:
+            return ''
+        elif isinstance(parsed, Formula):
+            return '=' + parsed.unparse(cell)
+        else:
+            return str(parsed)
 
     def get_parsed(self, cell) -> tuple|float|int|str|None:
-        return self.parsed.get(cell)
+        parsed = self.load(cell)
+        if isinstance(parsed, Formula):
+            return shift_refs(parsed.expr, cell)
+        return parsed
 
-    def get_value(self, cell) -> float|int|str|Bar|None|Exception:
-        parsed = self.get_parsed(cell)
-        if isinstance(parsed, tuple):
-            if cell not in self.cache:
-                self.cache[cell] = ReferenceError(cell)
+    def iter_deps(self, cell):
+        refs, ranges = self.parsed[cell].get_deps(cell)
+        yield from refs
+        for x1, y1, x2, y2 in ranges:
+            if (x1, y1, x2, y2) in self.calculated:
+                continue
+            for x in range(x1, x2 + 1):
+                self.load_range(x, y1, y2)
+                index = self.get_index(x, y2)
+                for y in index.iter_formulas(y1, y2):
+                    value = self.cache.get((x, y), EMPTY)
+                    if value is EMPTY:
+                        yield x, y
+                    else:
+                        # calculated without using the index, e.g. in bulk
+                        index.set_value(y, get_number(value))
+
+    def calculate(self, cell):
+        pending = set()
+        stack = [cell]
+        while stack:
+            cell = stack.pop()
+            if cell in pending:
+                pending.remove(cell)
                 try:
-                    self.cache[cell] = self.evaluate(parsed)
+                    self.cache[cell] = self.parsed[cell].fn(cell)
                 except Exception as err:
                     self.cache[cell] = err
+            elif cell not in self.cache:
+                self.cache[cell] = ReferenceError(cell)
+                pending.add(cell)
+                stack.append(cell)
+                deps = [
+                    dep for dep in self.iter_deps(cell)
+                    if dep not in self.cache
+                    and isinstance(self.load(dep), Formula)
+                ]
+                stack.extend(reversed(deps))
+                # other cells do not need to check these ranges again
+                if not deps:
+                    self.calculated.update(self.parsed[cell].fixed_ranges)
+
+    def get_value(self, cell) -> float|int|str|Bar|None|Exception:
+        parsed = self.parsed.get(cell)
+        if parsed is None and self.source is not None:
+            parsed = self.load(cell)
+        if isinstance(parsed, Formula):
+            if cell not in self.cache:
+                self.calculate(cell)
             return self.cache[cell]
         else:
             return parsed
@@ -0,0 +1,182 @@
+import builtins
+import marshal
+import mmap
+import struct
+
+from .expression import ParseError
+from .expression import RefError
+from .sheet import Bar
+from .sheet import Formula
+from .sheet import Sheet
+from .store import EMPTY
+from .store import MASK
+from .store import SHIFT
+from .store import CellStore
+
+EXTENSION = '.sheet'
+MAGIC = b'SHEET\x00\x02\n'
+LENGTH = struct.Struct('<Q')
+
+EXCEPTIONS = {
+    name: cls
+    for name, cls in vars(builtins).items()
+    if isinstance(cls, type) and issubclass(cls, Exception)
+}
+EXCEPTIONS['ParseError'] = ParseError
+EXCEPTIONS['RefError'] = RefError
+
+# Sections are marshalled separately, each prefixed with its length:
+#
+#   exprs       list of relative formula ASTs
+#   raw         {x: {chunk: [str|None]}}  raw text that cannot be restored
+#   parsed      {x: {chunk: [value|(formula id,)|()|None]}}  () is a parse error
+#   cache       {x: {chunk: [value|tuple|None]}}  see encode_value()
+#   rdeps       {x: {chunk: [cell|set|None]}}
+#   range_deps  (blocks, levels)
+#
+# None marks an empty slot in the chunks of CellStore.
+
+
+def encode_value(value):
+    if isinstance(value, Bar):
+        return ('bar', value.value)
+    elif isinstance(value, Exception):
+        if type(value).__name__ not in EXCEPTIONS:
+            return None
+        try:
+            marshal.dumps(value.args)
+        except ValueError:
+            return None
+        return ('exc', type(value).__name__, value.args)
+    elif value is None:
+        return ('none',)
+    else:
+        return value
+
+
+def decode_value(value):
+    if not isinstance(value, tuple):
+        return value
+    elif value[0] == 'bar':
+        return Bar(value[1])
+    elif value[0] == 'exc':
+        if value[1] in EXCEPTIONS:
+            return EXCEPTIONS[value[1]](*value[2])
+        return EMPTY
+    else:
+        return None
+
+
+def encode_store(store, encode):
+    if not isinstance(store, CellStore):
+        # e.g. a TileStore, which is read cell by cell
+        columns = {}
+        for (x, y), value in store.items():
+            column = columns.setdefault(x, {})
+            chunk = column.setdefault(y >> SHIFT, [None] * (MASK + 1))
+            chunk[y & MASK] = encode(value)
+        return columns
+    return {
+        x: {
+            c: [None if value is EMPTY else encode(value) for value in chunk]
+            for c, chunk in column.items()
+        }
+        for x, column in store.columns.items()
+    }
+
+
+def decode_store(columns, decode) -> CellStore:
+    store = CellStore()
+    for x, column in columns.items():
+        store.columns[x] = {}
+        for c, chunk in column.items():
+            chunk = [EMPTY if value is None else decode(value) for value in chunk]
+            store.columns[x][c] = chunk
+            store.size += len(chunk) - chunk.count(EMPTY)
+    return store
+
+
+def dump_snapshot(sheet, path):
+    sheet.load_all()
+    ids = {}
+    exprs = []
+
+    def encode_parsed(parsed):
+        if not isinstance(parsed, Formula):
+            return parsed
+        elif parsed.expr[0] == 'err':
+            return ()
+        elif id(parsed) not in ids:
+            ids[id(parsed)] = len(exprs)
+            exprs.append(parsed.expr)
+        return (ids[id(parsed)],)
+
+    sections = [
+        exprs,
+        encode_store(sheet.raw, str),
+        encode_store(sheet.parsed, encode_parsed),
+        encode_store(sheet.cache, encode_value),
+        encode_store(sheet.rdeps, lambda deps: deps),
+        (sheet.range_deps.blocks, sheet.range_deps.levels),
+    ]
+    with open(path, 'wb') as fh:
+        fh.write(MAGIC)
+        for section in sections:
+            data = marshal.dumps(section, 4)
+            fh.write(LENGTH.pack(len(data)))
+            fh.write(data)
+
+
+def read_sections(buf):
+    if buf[:len(MAGIC)] != MAGIC:
+        raise ValueError('not a snapshot')
+    pos = len(MAGIC)
+    sections = []
+    while pos < len(buf):
+        (length,) = LENGTH.unpack_from(buf, pos)
+        pos += LENGTH.size
+        with buf[pos:pos + length] as data:
+            sections.append(marshal.loads(data))
+        pos += length
+    return sections
+
+
+def load_snapshot(path) -> Sheet:
+    with (
+        open(path, 'rb') as fh,
+        mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm,
+        memoryview(mm) as buf,
+    ):
+        exprs, raw, parsed, cache, rdeps, range_deps = read_sections(buf)
+
+    sheet = Sheet()
+    formulas = [Formula(expr, sheet.compile(expr)) for expr in exprs]
+    sheet.formulas = {formula.expr: formula for formula in formulas}
+    for expr in exprs:
+        sheet.add_templates(expr)
+    errors = []
+
+    def decode_parsed(value):
+        if not isinstance(value, tuple):
+            return value
+        elif value:
+            formula = formulas[value[0]]
+            formula.count += 1
+            return formula
+        else:
+            errors.append(value)
+            return value
+
+    sheet.raw = decode_store(raw, str)
+    sheet.parsed = decode_store(parsed, decode_parsed)
+    sheet.cache = decode_store(cache, decode_value)
+    sheet.rdeps = decode_store(rdeps, lambda deps: deps)
+    sheet.range_deps.blocks, sheet.range_deps.levels = range_deps
+
+    # parse errors are not stored, so parse them again
+    if errors:
+        for cell, value in list(sheet.parsed.items()):
+            if value == ():
+                sheet.parsed[cell] = sheet.parse_relative(sheet.raw[cell], cell)
+                sheet.parsed[cell].count += 1
+    return sheet
@@ -0,0 +1,130 @@
+from collections.abc import MutableMapping
+
+EMPTY = object()
+
+# every chunk contains 2**SHIFT rows of a single column
+SHIFT = 10
+MASK = (1 << SHIFT) - 1
+
+
+def put_value(column: dict, y, value):
+    chunk = column.get(y >> SHIFT)
+    if chunk is None:
+        chunk = column[y >> SHIFT] = [EMPTY] * (MASK + 1)
+    chunk[y & MASK] = value
+
+
+class CellStore(MutableMapping):
+    # values are kept in fixed-size lists per column, so there is no key
+    # tuple and no dict entry per cell. Each column is a dict of chunks, so
+    # cells that are far away from all others do not cost more than one
+    # chunk.
+    def __init__(self):
+        self.columns = {}
+        self.size = 0
+
+    def __getitem__(self, cell):
+        value = self.get(cell, EMPTY)
+        if value is EMPTY:
+            raise KeyError(cell)
+        return value
+
+    def get(self, cell, default=None):
+        x, y = cell
+        column = self.columns.get(x)
+        if column is None or y < 0:
+            return default
+        chunk = column.get(y >> SHIFT)
+        if chunk is None:
+            return default
+        value = chunk[y & MASK]
+        return default if value is EMPTY else value
+
+    def __contains__(self, cell):
+        return self.get(cell, EMPTY) is not EMPTY
+
+    def __setitem__(self, cell, value):
+        x, y = cell
+        column = self.columns.setdefault(x, {})
+        chunk = column.get(y >> SHIFT)
+        if chunk is None:
+            chunk = column[y >> SHIFT] = [EMPTY] * (MASK + 1)
+        if chunk[y & MASK] is EMPTY:
+            self.size += 1
+        chunk[y & MASK] = value
+
+    def pop(self, cell, default=EMPTY):
+        value = self.get(cell, EMPTY)
+        if value is EMPTY:
+            if default is EMPTY:
+                raise KeyError(cell)
+            return default
+        x, y = cell
+        self.columns[x][y >> SHIFT][y & MASK] = EMPTY
+        self.size -= 1
+        return value
+
+    def __delitem__(self, cell):
+        self.pop(cell)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for cell, _value in self.items():
+            yield cell
+
+    def items(self):
+        for x in list(self.columns):
+            for y, value in self.iter_column(x):
+                yield (x, y), value
+
+    def iter_column(self, x, start=0, stop=None):
+        column = self.columns.get(x, {})
+        for c in sorted(column):
+            if stop is not None and c << SHIFT >= stop:
+                break
+            elif (c + 1) << SHIFT <= start:
+                continue
+            for i, value in enumerate(column[c]):
+                y = (c << SHIFT) + i
+                if value is not EMPTY and start <= y and (stop is None or y < stop):
+                    yield y, value
+
+    def move(self, axis, at, n):
+        # insert n rows (axis 1) or columns (axis 0) before `at`, or delete
+        # -n of them starting at `at`
+        end = at - min(n, 0)
+        if axis == 0:
+            columns = {}
+            for x, column in self.columns.items():
+                if x < at:
+                    columns[x] = column
+                elif x >= end:
+                    columns[x + n] = column
+                else:
+                    self.size -= sum(1 for _ in self.iter_column(x))
+            self.columns = columns
+        else:
+            for x, old in self.columns.items():
+                column = {}
+                for c, chunk in old.items():
+                    # chunks before `at` are kept as they are
+                    if (c + 1) << SHIFT <= at:
+                        column[c] = chunk
+                        continue
+                    for i, value in enumerate(chunk):
+                        y = (c << SHIFT) + i
+                        if value is EMPTY:
+                            continue
+                        elif y < at:
+                            put_value(column, y, value)
+                        elif y >= end:
+                            put_value(column, y + n, value)
+                        else:
+                            self.size -= 1
+                self.columns[x] = column
+
+    def clear(self):
+        self.columns = {}
+        self.size = 0
@@ -0,0 +1,161 @@
+import csv
+
+from .csv import to_display
+from .sheet import Formula
+from .sheet import Sheet
+from .snapshot import EXTENSION
+
+WINDOW = 1000
+
+
+def get_width(path, dialect, **kwargs):
+    width = 0
+    with open(path) as fh:
+        for row in csv.reader(fh, dialect=dialect, **kwargs):
+            for x in range(len(row), width, -1):
+                if row[x - 1]:
+                    width = x
+                    break
+    return max(width, 1)
+
+
+def iter_corners(formula: Formula, y):
+    # yields the referenced (row, fixed) pairs for every ref or range
+    for ref in formula.refs:
+        nodes = [ref] if ref[0] == 'ref' else [ref[1], ref[2]]
+        yield [
+            (node[1][1] if node[2][1] else y + node[1][1], node[2][1])
+            for node in nodes
+        ]
+
+
+def freeze(value) -> Formula:
+    # a formula without references that always returns the value, so the
+    # cell is still treated like a formula (e.g. in the range index)
+    return Formula(('err', value), lambda cell: value)
+
+
+class Window:
+    # Earlier rows are only needed as long as later formulas can reach them.
+    # When the window is rebuilt, the rows that are still needed are copied
+    # to a new sheet with formulas replaced by their values. Rows that are
+    # referenced with a fixed row (e.g. `$A$1`) are pinned at their original
+    # position, all other rows are moved up by `shift`.
+    def __init__(self, size):
+        self.size = size
+        self.sheet = Sheet()
+        self.rows = {}
+        self.pins = set()
+        self.start = 0
+        self.shift = 0
+
+    def pin(self, t):
+        for x, raw, parsed in self.rows[t]:
+            self.sheet.set_parsed((x, t), raw, parsed)
+        self.pins.add(t)
+
+    def check(self, corners, y) -> bool:
+        rows = [t for t, _ in corners]
+        fixed = {f for _, f in corners}
+        t1, t2 = min(rows), max(rows)
+        if t2 > y:
+            return False
+        elif self.shift == 0:
+            if not all(t in self.pins for t in range(t1, min(t2 + 1, self.start))):
+                return False
+            if fixed == {True}:
+                self.pins.update(range(t1, t2 + 1))
+            return True
+        elif fixed == {False}:
+            return t1 >= self.start
+        elif fixed == {True}:
+            for t in range(t1, t2 + 1):
+                if t in self.pins:
+                    continue
+                if not (self.start <= t < y and t < self.start - self.shift):
+                    return False
+                self.pin(t)
+            return True
+        else:
+            return False
+
+    def rebuild(self, y):
+        self.start = y + 1 - self.size
+        # keep the alignment of the range index so that sums are computed
+        # in the same order
+        align = 1 << (2 * self.size).bit_length()
+        shift = self.start - max(self.pins, default=-1) - 1
+        self.shift = shift // align * align
+        self.rows = {
+            t: row for t, row in self.rows.items()
+            if t >= self.start or t in self.pins
+        }
+        self.sheet = Sheet()
+        with self.sheet.batch():
+            for t, row in self.rows.items():
+                for x, raw, parsed in row:
+                    if t in self.pins:
+                        self.sheet.set_parsed((x, t), raw, parsed)
+                    if t >= self.start:
+                        self.sheet.set_parsed((x, t - self.shift), raw, parsed)
+
+    def push(self, y, row, width) -> list|None:
+        # returns the values of the row or None if the row cannot be
+        # evaluated in the window
+        p = y - self.shift
+        cells = []
+        for x, raw in enumerate(row):
+            if raw:
+                parsed = self.sheet.parse_relative(raw, (x, y))
+                if isinstance(parsed, Formula) and not all(
+                    self.check(corners, y) for corners in iter_corners(parsed, y)
+                ):
+                    return None
+                cells.append((x, raw, parsed))
+
+        with self.sheet.batch():
+            for x, raw, parsed in cells:
+                self.sheet.set_parsed((x, p), raw, parsed)
+        values = [self.sheet.get_value((x, p)) for x in range(width)]
+        # cycles are reported with the position of the cell
+        if self.shift and any(isinstance(v, ReferenceError) for v in values):
+            return None
+
+        self.rows[y] = [
+            (x, raw, freeze(values[x]) if isinstance(parsed, Formula) else parsed)
+            for x, raw, parsed in cells
+        ]
+        if y + 1 - self.start >= 2 * self.size:
+            self.rebuild(y)
+        return values
+
+
+def stream_csv(path, out_path, *, window=WINDOW, **kwargs) -> bool:
+    # Evaluate a CSV file row by row while only keeping a window of rows in
+    # memory. Returns False if a formula refers to a later row or to a row
+    # that is no longer available. The output is incomplete in that case.
+    if path.endswith(EXTENSION) or out_path.endswith(EXTENSION):
+        return False
+    dialect = 'excel-tab' if path.endswith('.tsv') else 'excel'
+    out_dialect = 'excel-tab' if out_path.endswith('.tsv') else 'excel'
+    width = get_width(path, dialect, **kwargs)
+    stream = Window(window)
+    empty = 0
+    written = False
+    with open(path) as fh, open(out_path, 'w') as out:
+        w = csv.writer(out, dialect=out_dialect, **kwargs)
+        for y, row in enumerate(csv.reader(fh, dialect=dialect, **kwargs)):
+            values = stream.push(y, row, width)
+            if values is None:
+                return False
+            if any(row):
+                for _ in range(empty):
+                    w.writerow([''] * width)
+                empty = 0
+                w.writerow([to_display(value) for value in values])
+                written = True
+            else:
+                empty += 1
+        if not written:
+            w.writerow([''] * width)
+    return True
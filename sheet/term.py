@@ -8,22 +8,29 @@ INVERT = boon.get_cap('rev')
 RESET = boon.get_cap('sgr0')
 
 
+def get_width(s):
+    # wcswidth is slow, so plain ASCII is handled separately
+    if s.isascii() and s.isprintable():
+        return len(s)
+    return wcswidth(s)
+
+
 def align_right(s, width):
-    w = wcswidth(s)
+    w = get_width(s)
     if w > width:
         return '#' * width
     return ' ' * (width - w) + s
 
 
 def align_left(s, width):
-    w = wcswidth(s)
+    w = get_width(s)
     if w > width:
         return '#' * width
     return s + ' ' * (width - w)
 
 
 def align_center(s, width):
-    w = wcswidth(s)
+    w = get_width(s)
     if w > width:
         return '#' * width
     t = width - w
@@ -0,0 +1,274 @@
+import marshal
+import sqlite3
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+from .sheet import Formula
+from .sheet import Sheet
+from .snapshot import EXCEPTIONS
+from .snapshot import decode_value
+from .snapshot import encode_value
+from .store import EMPTY
+
+# every tile contains 2**SHIFT rows of a single column
+SHIFT = 8
+MASK = (1 << SHIFT) - 1
+MAX_TILES = 1024
+# marks databases created by Database, so that no other file is overwritten
+USER_VERSION = 0x5348
+
+
+def identity(value):
+    return value
+
+
+class TileStore(MutableMapping):
+    # Same interface as CellStore, but the columns are split into tiles that
+    # are stored in an SQLite table. Only the most recently used tiles are
+    # kept in memory. Changed tiles are written when they are evicted, a
+    # quarter of the tiles at a time. Tiles that do not exist are cached as
+    # None. `columns` only contains the indexes.
+    def __init__(
+        self, db, name, encode=identity, decode=identity, max_tiles=MAX_TILES
+    ):
+        self.db = db
+        self.name = name
+        self.encode = encode
+        self.decode = decode
+        self.max_tiles = max_tiles
+        self.tiles = OrderedDict()
+        self.changed = set()
+        self.columns = set()
+        self.size = 0
+        self.db.execute(f'DROP TABLE IF EXISTS {name}')
+        self.db.execute(
+            f'CREATE TABLE {name} '
+            '(x INTEGER, t INTEGER, data BLOB, PRIMARY KEY (x, t))'
+        )
+
+    def load(self, key) -> list|None:
+        row = self.db.execute(
+            f'SELECT data FROM {self.name} WHERE x = ? AND t = ?', key
+        ).fetchone()
+        if row is None:
+            return None
+        return [
+            EMPTY if value is None else self.decode(value)
+            for value in marshal.loads(row[0])
+        ]
+
+    def dump(self, tile) -> bytes:
+        # values that cannot be encoded (see encode_value) are not stored, so
+        # they are removed from the tile as well and no longer counted
+        data = []
+        for i, value in enumerate(tile):
+            if value is not EMPTY:
+                value = self.encode(value)
+                if value is None:
+                    tile[i] = EMPTY
+                    self.size -= 1
+            data.append(None if value is EMPTY else value)
+        return marshal.dumps(data)
+
+    def get_tile(self, x, t, create=False) -> list|None:
+        key = (x, t)
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            tile = self.tiles[key]
+        else:
+            tile = self.load(key)
+            self.tiles[key] = tile
+            if len(self.tiles) > self.max_tiles:
+                self.evict(len(self.tiles) - self.max_tiles * 3 // 4)
+        if tile is None and create:
+            tile = [EMPTY] * (MASK + 1)
+            self.tiles[key] = tile
+        return tile
+
+    def evict(self, n):
+        rows = []
+        for _ in range(n):
+            key, tile = self.tiles.popitem(last=False)
+            if key in self.changed:
+                self.changed.remove(key)
+                rows.append((*key, self.dump(tile)))
+        self.write(rows)
+
+    def write(self, rows):
+        if rows:
+            with self.db:
+                query = f'INSERT OR REPLACE INTO {self.name} VALUES (?, ?, ?)'
+                self.db.executemany(query, rows)
+
+    def flush(self):
+        self.write([
+            (*key, self.dump(self.tiles[key])) for key in sorted(self.changed)
+        ])
+        self.changed = set()
+
+    def iter_keys(self, x=None) -> list:
+        self.flush()
+        if x is None:
+            query = f'SELECT x, t FROM {self.name} ORDER BY x, t'
+            return self.db.execute(query).fetchall()
+        query = f'SELECT x, t FROM {self.name} WHERE x = ? ORDER BY t'
+        return self.db.execute(query, (x,)).fetchall()
+
+    def __getitem__(self, cell):
+        value = self.get(cell, EMPTY)
+        if value is EMPTY:
+            raise KeyError(cell)
+        return value
+
+    def get(self, cell, default=None):
+        x, y = cell
+        if y < 0:
+            return default
+        tile = self.get_tile(x, y >> SHIFT)
+        if tile is None:
+            return default
+        value = tile[y & MASK]
+        return default if value is EMPTY else value
+
+    def __contains__(self, cell):
+        return self.get(cell, EMPTY) is not EMPTY
+
+    def __setitem__(self, cell, value):
+        x, y = cell
+        tile = self.get_tile(x, y >> SHIFT, create=True)
+        if tile[y & MASK] is EMPTY:
+            self.size += 1
+        tile[y & MASK] = value
+        self.changed.add((x, y >> SHIFT))
+        self.columns.add(x)
+
+    def pop(self, cell, default=EMPTY):
+        value = self.get(cell, EMPTY)
+        if value is EMPTY:
+            if default is EMPTY:
+                raise KeyError(cell)
+            return default
+        x, y = cell
+        self.get_tile(x, y >> SHIFT)[y & MASK] = EMPTY
+        self.changed.add((x, y >> SHIFT))
+        self.size -= 1
+        return value
+
+    def __delitem__(self, cell):
+        self.pop(cell)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for cell, _value in self.items():
+            yield cell
+
+    def items(self):
+        for x, t in self.iter_keys():
+            tile = self.get_tile(x, t)
+            for i, value in enumerate(tile):
+                if value is not EMPTY:
+                    yield (x, (t << SHIFT) + i), value
+
+    def iter_column(self, x, start=0, stop=None):
+        for _, t in self.iter_keys(x):
+            if stop is not None and t << SHIFT >= stop:
+                break
+            elif (t + 1) << SHIFT <= start:
+                continue
+            tile = self.get_tile(x, t)
+            for i, value in enumerate(tile):
+                y = (t << SHIFT) + i
+                if value is not EMPTY and start <= y and (stop is None or y < stop):
+                    yield y, value
+
+    def move(self, axis, at, n):
+        # Cells are moved one by one, so memory stays bounded. When
+        # inserting, later cells are moved first so they are not overwritten.
+        end = at - min(n, 0)
+        if axis == 0:
+            keys = [(x, t) for x, t in self.iter_keys() if x >= at]
+        else:
+            keys = [
+                (x, t) for x, t in self.iter_keys() if (t + 1) << SHIFT > at
+            ]
+        if n > 0:
+            keys.reverse()
+        for x, t in keys:
+            tile = self.get_tile(x, t)
+            rows = range(len(tile))
+            for i in reversed(rows) if n > 0 else rows:
+                value = tile[i]
+                cell = (x, (t << SHIFT) + i)
+                if value is EMPTY or cell[axis] < at:
+                    continue
+                self.pop(cell)
+                if cell[axis] >= end:
+                    if axis == 0:
+                        self[cell[0] + n, cell[1]] = value
+                    else:
+                        self[cell[0], cell[1] + n] = value
+        if axis == 0:
+            self.columns = {
+                x if x < at else x + n
+                for x in self.columns
+                if x < at or x >= end
+            }
+
+    def clear(self):
+        with self.db:
+            self.db.execute(f'DELETE FROM {self.name}')
+        self.tiles = OrderedDict()
+        self.changed = set()
+        self.columns = set()
+        self.size = 0
+
+
+class Database:
+    # Scratch storage for sheets that do not fit into memory. The content of
+    # the file is replaced if it was created by this class, other databases
+    # are refused. Dependencies are stored as well, but formulas are still
+    # kept in memory. The indexes for ranges are kept in memory, but limited
+    # to about as many rows as the cached tiles.
+    def __init__(self, path, max_tiles=MAX_TILES):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        query = 'SELECT count(*) FROM sqlite_master'
+        tables = self.db.execute(query).fetchone()[0]
+        if version != USER_VERSION and tables:
+            self.db.close()
+            raise ValueError(f'not a sheet database: {path}')
+        self.db.execute(f'PRAGMA user_version = {USER_VERSION}')
+        self.db.execute('PRAGMA journal_mode = OFF')
+        self.db.execute('PRAGMA synchronous = OFF')
+        self.max_tiles = max_tiles
+
+    def store(self, name, encode=identity, decode=identity) -> TileStore:
+        return TileStore(self.db, name, encode, decode, self.max_tiles)
+
+    def sheet(self) -> Sheet:
+        sheet = Sheet()
+        sheet.max_index = self.max_tiles << SHIFT
+
+        def encode_parsed(parsed):
+            if not isinstance(parsed, Formula):
+                return parsed
+            elif parsed.expr[0] == 'err':
+                err = parsed.expr[1]
+                return ('err', type(err).__name__, str(err))
+            return (parsed.expr,)
+
+        def decode_parsed(value):
+            if not isinstance(value, tuple):
+                return value
+            elif value[0] == 'err':
+                expr = ('err', EXCEPTIONS[value[1]](value[2]))
+                return Formula(expr, sheet.compile(expr))
+            return sheet.get_formula(value[0])
+
+        sheet.raw = self.store('raw', str, str)
+        sheet.parsed = self.store('parsed', encode_parsed, decode_parsed)
+        sheet.cache = self.store('cache', encode_value, decode_value)
+        sheet.rdeps = self.store('rdeps')
+        return sheet
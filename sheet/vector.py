@@ -0,0 +1,214 @@
+from importlib.util import find_spec
+
+from .sheet import Bar
+from .sheet import Formula
+
+MIN_RUN = 16
+# longer runs are split so that memory stays bounded
+MAX_RUN = 2 ** 16
+MAX_INT = 2 ** 53
+
+# Importing numpy takes about as long as evaluating this many cells without
+# it, so it is only imported by vectorize() for larger sheets.
+MIN_IMPORT = 20000
+HAS_NUMPY = find_spec('numpy') is not None
+numpy = None
+
+
+def iter_runs(sheet):
+    for x in list(sheet.parsed.columns):
+        run = None
+        for y, parsed in sheet.parsed.iter_column(x):
+            if not isinstance(parsed, Formula):
+                continue
+            elif (
+                run
+                and y == run[2] + 1
+                and parsed is run[3]
+                and y - run[1] < MAX_RUN
+            ):
+                run[2] = y
+                continue
+            if run and run[2] - run[1] + 1 >= MIN_RUN:
+                yield tuple(run)
+            run = [x, y, y, parsed]
+        if run and run[2] - run[1] + 1 >= MIN_RUN:
+            yield tuple(run)
+
+
+def strip_braces(expr):
+    while expr[0] == 'brace':
+        expr = expr[1]
+    return expr
+
+
+def is_numeric(expr):
+    expr = strip_braces(expr)
+    if expr[0] in ['int', 'float', 'ref']:
+        return True
+    elif expr[0] in ['str', 'err', 'range']:
+        return False
+    elif expr[0] in '+-*/':
+        return is_numeric(expr[1]) and is_numeric(expr[2])
+    else:
+        return False
+
+
+def get_body(expr):
+    # returns the arithmetic expression and whether the result is a bar
+    expr = strip_braces(expr)
+    if expr[0] in ['str', 'err', 'range']:
+        return None, False
+    elif expr[0] in '+-*/':
+        return expr if is_numeric(expr) else None, False
+    elif expr[0] not in ['int', 'float', 'ref'] and expr[0].lower() == 'bar':
+        if len(expr[1]) == 1 and is_numeric(expr[1][0]):
+            return expr[1][0], True
+    return None, False
+
+
+def get_inputs(run):
+    # yields (ref, x, y1, y2) for every reference of the run
+    x, y1, y2, formula = run
+    for ref in formula.refs:
+        (dx, dy), (x_fixed, y_fixed) = ref[1], ref[2]
+        ix = dx if x_fixed else x + dx
+        if y_fixed:
+            yield ref, ix, dy, dy
+        else:
+            yield ref, ix, y1 + dy, y2 + dy
+
+
+def gather(sheet, x, y1, y2):
+    # returns (values, is_int, valid) arrays
+    values = [sheet.get_value((x, y)) for y in range(y1, y2 + 1)]
+    types = set(map(type, values))
+    if types == {float}:
+        n = len(values)
+        return numpy.array(values), numpy.zeros(n, bool), numpy.ones(n, bool)
+
+    is_int = numpy.zeros(len(values), dtype=bool)
+    valid = numpy.zeros(len(values), dtype=bool)
+    for i, value in enumerate(values):
+        if isinstance(value, Bar):
+            value = value.value
+        if value is None:
+            value = 0
+        if type(value) is int:
+            is_int[i] = True
+            valid[i] = abs(value) < MAX_INT
+        elif type(value) is float:
+            valid[i] = True
+        values[i] = value if valid[i] else 0
+    return numpy.array(values, dtype=float), is_int, valid
+
+
+def build(expr, inputs):
+    # returns (values, is_int, valid) where valid marks the cells that have
+    # exactly the same result as with Sheet.evaluate
+    # scalars are numpy floats so that e.g. division by zero does not raise
+    if expr[0] == 'int':
+        if abs(expr[1]) >= MAX_INT:
+            return numpy.float64(0), True, False
+        return numpy.float64(expr[1]), True, True
+    elif expr[0] == 'float':
+        return numpy.float64(expr[1]), False, True
+    elif expr[0] == 'ref':
+        return inputs[expr]
+    elif expr[0] == 'brace':
+        return build(expr[1], inputs)
+
+    a, a_int, a_valid = build(expr[1], inputs)
+    b, b_int, b_valid = build(expr[2], inputs)
+    valid = a_valid & b_valid
+    if expr[0] == '/':
+        return a / b, False, valid & (b != 0)
+    elif expr[0] == '+':
+        result = a + b
+    elif expr[0] == '-':
+        result = a - b
+    else:
+        result = a * b
+    is_int = a_int & b_int
+    return result, is_int, valid & ~(is_int & (numpy.abs(result) >= MAX_INT))
+
+
+def evaluate_run(sheet, run):
+    x, y1, y2, formula = run
+    body, is_bar = get_body(formula.expr)
+    inputs = {}
+    for ref, ix, iy1, iy2 in get_inputs(run):
+        if ref not in inputs:
+            inputs[ref] = gather(sheet, ix, iy1, iy2)
+            if ref[2][1]:
+                inputs[ref] = tuple(a[0] for a in inputs[ref])
+
+    n = y2 - y1 + 1
+    with numpy.errstate(all='ignore'):
+        values, is_int, valid = (
+            numpy.broadcast_to(a, (n,)).tolist()
+            for a in build(body, inputs)
+        )
+    for y, value, value_is_int, value_valid in zip(
+        range(y1, y2 + 1), values, is_int, valid
+    ):
+        if value_valid:
+            if value_is_int:
+                value = int(value)
+            sheet.cache[x, y] = Bar(value) if is_bar else value
+
+
+def overlaps(run, x, y1, y2):
+    return run[0] == x and run[1] <= y2 and y1 <= run[2]
+
+
+def sort_runs(runs):
+    # evaluate runs after the runs they read from
+    columns = {}
+    for i, run in enumerate(runs):
+        columns.setdefault(run[0], []).append(i)
+    users = {i: set() for i in range(len(runs))}
+    waiting = {}
+    for i, run in enumerate(runs):
+        deps = {
+            j
+            for _, x, y1, y2 in get_inputs(run)
+            for j in columns.get(x, [])
+            if j != i and overlaps(runs[j], x, y1, y2)
+        }
+        for j in deps:
+            users[j].add(i)
+        waiting[i] = len(deps)
+    ready = [i for i in waiting if not waiting[i]]
+    order = []
+    while ready:
+        i = ready.pop()
+        order.append(runs[i])
+        for j in users[i]:
+            waiting[j] -= 1
+            if not waiting[j]:
+                ready.append(j)
+    return order + [runs[i] for i in waiting if waiting[i]]
+
+
+def vectorize(sheet):
+    # evaluate runs of cells that share a relative formula as numpy arrays
+    # and store the results in the cache. Anything that cannot be evaluated
+    # with exactly the same result is left to the scalar evaluator.
+    global numpy
+    if not HAS_NUMPY:
+        return
+    runs = []
+    for run in iter_runs(sheet):
+        body, _ = get_body(run[3].expr)
+        if body is not None and not any(
+            overlaps(run, x, y1, y2) for _, x, y1, y2 in get_inputs(run)
+        ):
+            runs.append(run)
+    if numpy is None:
+        if sum(run[2] - run[1] + 1 for run in runs) < MIN_IMPORT:
+            return
+        import numpy
+    for run in sort_runs(runs):
+        if any((run[0], y) not in sheet.cache for y in range(run[1], run[2] + 1)):
+            evaluate_run(sheet, run)
@@ -0,0 +1,126 @@
+import csv
+import io
+import os
+import time
+
+from .csv import to_display
+from .sheet import Sheet
+from .store import EMPTY
+from .store import SHIFT
+from .vector import vectorize
+
+INTERVAL = 1
+
+
+def get_stat(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def get_size(store) -> tuple[int, int]:
+    width = 0
+    height = 0
+    for x, column in store.columns.items():
+        for c in sorted(column, reverse=True):
+            chunk = column[c]
+            i = len(chunk)
+            while i and chunk[i - 1] is EMPTY:
+                i -= 1
+            if i:
+                width = max(width, x + 1)
+                height = max(height, (c << SHIFT) + i)
+                break
+    return max(width, 1), max(height, 1)
+
+
+class Watcher:
+    # Keeps the sheet and the evaluated output in memory. Only rows whose
+    # hash changed are compared cell by cell, and only the rows of
+    # invalidated cells are formatted again.
+    def __init__(self, path, out_path, **kwargs):
+        self.path = path
+        self.out_path = out_path
+        self.kwargs = kwargs
+        self.dialect = 'excel-tab' if path.endswith('.tsv') else 'excel'
+        self.out_dialect = 'excel-tab' if out_path.endswith('.tsv') else 'excel'
+        self.sheet = Sheet()
+        self.rows = []  # (hash, length) of every row in the file
+        self.lines = []
+        self.width = 0
+
+    def read(self):
+        with open(self.path) as fh:
+            return list(csv.reader(fh, dialect=self.dialect, **self.kwargs))
+
+    def update(self, rows) -> set:
+        new = [(hash(tuple(row)), len(row)) for row in rows]
+        with self.sheet.batch() as dirty:
+            for y in range(max(len(new), len(self.rows))):
+                old = self.rows[y] if y < len(self.rows) else (None, 0)
+                if y < len(new) and new[y] == old:
+                    continue
+                row = rows[y] if y < len(rows) else []
+                if old[0] is None:
+                    # new row
+                    for x, raw in enumerate(row):
+                        if raw:
+                            self.sheet.set((x, y), raw)
+                    continue
+                for x in range(max(len(row), old[1])):
+                    raw = row[x] if x < len(row) else ''
+                    if self.sheet.get_raw((x, y)) != raw:
+                        self.sheet.set((x, y), raw)
+        self.rows = new
+        return dirty
+
+    def format_row(self, y) -> str:
+        out = io.StringIO()
+        w = csv.writer(out, dialect=self.out_dialect, **self.kwargs)
+        w.writerow([
+            to_display(self.sheet.get_value((x, y))) for x in range(self.width)
+        ])
+        return out.getvalue()
+
+    def write(self, dirty):
+        width, height = get_size(self.sheet.parsed)
+        if width != self.width:
+            self.width = width
+            self.lines = []
+        for y in sorted({y for _, y in dirty if y < len(self.lines)}):
+            self.lines[y] = self.format_row(y)
+        del self.lines[height:]
+        for y in range(len(self.lines), height):
+            self.lines.append(self.format_row(y))
+        with open(self.out_path, 'w') as fh:
+            fh.write(''.join(self.lines))
+
+    def poll(self, stat):
+        # returns the stat of the file that was evaluated last
+        try:
+            new_stat = get_stat(self.path)
+            if new_stat == stat:
+                return stat
+            rows = self.read()
+            # the file is still being written
+            if get_stat(self.path) != new_stat:
+                return stat
+        except OSError:
+            # the file might be deleted and created again, so try again at
+            # the next interval
+            return stat
+        self.write(self.update(rows))
+        return new_stat
+
+    def run(self, interval=INTERVAL):
+        stat = get_stat(self.path)
+        self.update(self.read())
+        vectorize(self.sheet)
+        self.write(set())
+        while True:
+            time.sleep(interval)
+            stat = self.poll(stat)
+
+
+def watch_csv(path, out_path, *, interval=INTERVAL, **kwargs):
+    # evaluate a CSV file and update the output whenever the file changes
+    Watcher(path, out_path, **kwargs).run(interval)
@@ -0,0 +1,84 @@
+import threading
+import time
+
+from .sheet import Formula
+
+SLICE = 0.01
+
+
+class Worker:
+    # Calculates cells in a background thread. The sheet must only be
+    # accessed while holding `lock`. The worker releases it after every
+    # slice, so other threads never have to wait for a whole calculation.
+    def __init__(self, sheet, notify):
+        self.sheet = sheet
+        self.notify = notify
+        self.lock = threading.RLock()
+        self.event = threading.Event()
+        self.cells = []
+        self.stack = []
+        self.visited = set()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def request(self, cells, changed=False):
+        # calculate these cells (in order) instead of the previous ones.
+        # `changed` must be set if the sheet changed since the last call,
+        # because the cells on the stack might no longer be formulas.
+        # Must be called while holding the lock.
+        if changed or cells != self.cells or not self.stack:
+            self.cells = cells
+            self.stack = list(reversed(cells))
+            self.visited = set()
+            if cells:
+                self.event.set()
+
+    def stop(self):
+        self.running = False
+        self.event.set()
+        self.thread.join()
+
+    def step(self) -> bool:
+        # Dependencies are visited first so that every call to calculate()
+        # only evaluates a single formula. Cycles are left to calculate().
+        cell = self.stack.pop()
+        if cell in self.sheet.cache:
+            return False
+        elif not isinstance(self.sheet.load(cell), Formula):
+            return False
+        elif cell in self.visited:
+            self.sheet.calculate(cell)
+            return True
+        self.visited.add(cell)
+        deps = [
+            dep for dep in self.sheet.iter_deps(cell)
+            if dep not in self.visited
+            and dep not in self.sheet.cache
+            and isinstance(self.sheet.load(dep), Formula)
+        ]
+        self.stack.append(cell)
+        self.stack.extend(deps)
+        return False
+
+    def run(self):
+        while True:
+            self.event.wait()
+            if not self.running:
+                break
+            changed = False
+            with self.lock:
+                end = time.monotonic() + SLICE
+                while self.stack and time.monotonic() < end:
+                    # a cell that fails is dropped, calculate() will
+                    # report the error when the cell is needed
+                    try:
+                        changed |= self.step()
+                    except Exception:
+                        pass
+                if not self.stack:
+                    self.event.clear()
+            if changed:
+                self.notify()
+            # let other threads take the lock
+            time.sleep(0)
@@ -0,0 +1,115 @@
+import random
+
+from sheet.expression import x2col
+from sheet.sheet import Bar
+from sheet.sheet import Formula
+from sheet.sheet import Sheet
+from sheet.sheet import iter_range
+
+
+def random_ref(rnd, width, height):
+    x = rnd.randrange(width)
+    y = rnd.randrange(height)
+    return f'{"$" if rnd.random() < 0.2 else ""}{x2col(x)}{y + 1}'
+
+
+def random_range(rnd, width, height):
+    ref1 = random_ref(rnd, width, height)
+    ref2 = random_ref(rnd, width, height)
+    return f'{ref1}:{ref2}'
+
+
+def random_raw(rnd: random.Random, width, height) -> str:
+    kind = rnd.random()
+    if kind < 0.15:
+        return ''
+    elif kind < 0.35:
+        return str(rnd.randint(-3, 9))
+    elif kind < 0.4:
+        return rnd.choice(['0.5', '2.25', 'foo'])
+    ref1 = random_ref(rnd, width, height)
+    ref2 = random_ref(rnd, width, height)
+    rng = random_range(rnd, width, height)
+    return rnd.choice([
+        f'={ref1}+{ref2}',
+        f'={ref1}*2-{ref2}',
+        f'={ref1}/{ref2}',
+        f'=({ref1}+1)*3',
+        f'=sum({rng})',
+        f'=max({rng})+{ref1}',
+        f'=min({rng})',
+        f'=bar({ref1})',
+        f'=countif({rng}, ">1")',
+        '=1+2*3',
+    ])
+
+
+def random_rows(rnd, width, height) -> list[list[str]]:
+    return [
+        [random_raw(rnd, width, height) for _ in range(width)]
+        for _ in range(height)
+    ]
+
+
+def load(rows) -> Sheet:
+    sheet = Sheet()
+    with sheet.batch():
+        for y, row in enumerate(rows):
+            for x, raw in enumerate(row):
+                sheet.set((x, y), raw)
+    return sheet
+
+
+def get_rows(sheet, width, height) -> list[list[str]]:
+    return [
+        [sheet.get_raw((x, y)) for x in range(width)]
+        for y in range(height)
+    ]
+
+
+def key(value):
+    # cycles are reported with the cell where they were found, which
+    # depends on the order of evaluation
+    if isinstance(value, Bar):
+        return 'bar', repr(value.value)
+    elif isinstance(value, Exception):
+        return type(value).__name__
+    return type(value).__name__, repr(value)
+
+
+def get_deps(sheet, cell) -> set:
+    parsed = sheet.parsed.get(cell)
+    if not isinstance(parsed, Formula):
+        return set()
+    refs, ranges = parsed.get_deps(cell)
+    deps = set(refs)
+    for x1, y1, x2, y2 in ranges:
+        deps.update(iter_range((x1, y1), (x2, y2)))
+    return deps
+
+
+def get_cycles(sheet, cells) -> set:
+    # cells that are part of a cycle or depend on one. Their values depend
+    # on the order of evaluation.
+    reach = {}
+    for cell in cells:
+        seen = set()
+        stack = list(get_deps(sheet, cell))
+        while stack:
+            dep = stack.pop()
+            if dep not in seen:
+                seen.add(dep)
+                stack.extend(get_deps(sheet, dep))
+        reach[cell] = seen
+    cyclic = {cell for cell in cells if cell in reach[cell]}
+    return {cell for cell in cells if cyclic & (reach[cell] | {cell})}
+
+
+def get_values(sheet, width, height, order=None) -> dict:
+    cells = [(x, y) for y in range(height) for x in range(width)]
+    if order is not None:
+        order.shuffle(cells)
+    values = {cell: key(sheet.get_value(cell)) for cell in cells}
+    for cell in get_cycles(sheet, cells):
+        values[cell] = 'cycle'
+    return values
@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+if not os.environ.get('TERM'):
+    pytest.skip('boon needs a terminal', allow_module_level=True)
+
+from sheet.app import App
+
+
+def make_app(rows):
+    app = App()
+    # values are calculated here instead of in the background
+    app.worker.stop()
+    with app.sheet.batch():
+        for y, row in enumerate(rows):
+            for x, raw in enumerate(row):
+                app.sheet.set((x, y), raw)
+    calculate(app)
+    return app
+
+
+def calculate(app):
+    for cell in list(app.sheet.parsed):
+        app.sheet.get_value(cell)
+
+
+def test_edit_renders_only_affected_rows():
+    app = make_app([['1', '=A1*2'], ['2', '=A2+1'], ['=B1+1']])
+    lines = list(app.render(8, 40))
+    assert app.sheet.dirty == set()
+    old = dict(app.lines)
+
+    app.sheet.set((0, 0), '5')
+    assert app.sheet.dirty == {(0, 0), (1, 0), (0, 2)}
+    calculate(app)
+
+    rendered = []
+    render_row = app.render_row
+
+    def recorded(y, key, old_cells):
+        rendered.append(y)
+        return render_row(y, key, old_cells)
+
+    app.render_row = recorded
+    new = list(app.render(8, 40))
+    assert rendered == [0, 2]
+    assert app.sheet.dirty == set()
+    assert new[1] != lines[1] and '10' in new[1]
+    assert new[3] != lines[3] and '11' in new[3]
+    assert app.lines[1][1] is old[1][1]
+
+    # nothing changed
+    rendered.clear()
+    assert list(app.render(8, 40)) == new
+    assert rendered == []
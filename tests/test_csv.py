@@ -0,0 +1,38 @@
+import csv
+import random
+
+import pytest
+from helpers import get_values
+from helpers import random_rows
+
+from sheet.csv import load_csv
+
+
+def write_rows(path, rows):
+    with open(path, 'w') as fh:
+        csv.writer(fh).writerows(rows)
+
+
+def test_lazy_reads_only_needed_rows(tmp_path):
+    path = str(tmp_path / 'large.csv')
+    write_rows(path, [[str(y), f'=A{y + 1}*2'] for y in range(10000)])
+    sheet = load_csv(path, lazy=True)
+    assert sheet.get_value((1, 2)) == 4
+    # only the rows up to the cell are read and only the cells that are
+    # needed are parsed
+    assert sheet.source.rows == 3
+    assert sorted(sheet.parsed) == [(0, 2), (1, 2)]
+    assert len(sheet.source.raw) == 4
+
+    assert sheet.get_value((1, 9999)) == 19998
+    assert sheet.source.rows == 10000
+    assert len(sheet.parsed) == 4
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_lazy_same_as_full_load(tmp_path, seed):
+    rnd = random.Random(seed)
+    path = str(tmp_path / 'sheet.csv')
+    write_rows(path, random_rows(rnd, 5, 8))
+    expected = get_values(load_csv(path), 5, 8)
+    assert get_values(load_csv(path, lazy=True), 5, 8, order=rnd) == expected
@@ -0,0 +1,185 @@
+import random
+import re
+
+import pytest
+
+from sheet.expression import ParseError
+from sheet.expression import col2x
+from sheet.expression import parse
+from sheet.expression import shift_refs
+from sheet.expression import unparse
+
+# The backtracking parser that was replaced by the tokenizer. It is kept
+# here to check that both produce the same ASTs.
+
+
+def old_parse_any(text, parsers):
+    for parser in parsers:
+        try:
+            return parser(text)
+        except ParseError:
+            pass
+    raise ParseError(text)
+
+
+def old_parse_re(text, pattern):
+    m = re.match(pattern, text)
+    if not m:
+        raise ParseError
+    return m, text[m.end():]
+
+
+def old_parse_string(text):
+    m, tail = old_parse_re(text, r'"[^"]*"')
+    return ('str', m[0][1:-1], m[0]), tail
+
+
+def old_parse_float(text):
+    m, tail = old_parse_re(text, r'[0-9]+\.[0-9]+')
+    return ('float', float(m[0]), m[0]), tail
+
+
+def old_parse_int(text):
+    m, tail = old_parse_re(text, r'[0-9]+')
+    return ('int', int(m[0], 10), m[0]), tail
+
+
+def old_parse_ref(text):
+    m, tail = old_parse_re(text, r'(\$)?([A-Z]+)(\$)?([1-9][0-9]*)')
+    x = col2x(m[2])
+    y = int(m[4], 10) - 1
+    return ('ref', (x, y), (bool(m[1]), bool(m[3]))), tail
+
+
+def old_parse_range(text):
+    ref1, tail = old_parse_ref(text)
+    _, tail = old_parse_re(tail, r':')
+    ref2, tail = old_parse_ref(tail)
+    return ('range', ref1, ref2), tail
+
+
+def old_parse_brace(text):
+    _, tail = old_parse_re(text, r'\(')
+    exp, tail = old_parse_expression(tail)
+    _, tail = old_parse_re(tail, r'\)')
+    return ('brace', exp), tail
+
+
+def old_parse_call(text):
+    m, tail = old_parse_re(text, r'[a-zA-Z][a-zA-Z0-9]*')
+    _, tail = old_parse_re(tail, r'\(')
+    args = []
+    commas = []
+    if tail.startswith(')'):
+        return (m[0], args, commas), tail[1:]
+    while True:
+        arg, tail = old_parse_expression(tail)
+        args.append(arg)
+        if tail.startswith(')'):
+            return (m[0], args, commas), tail[1:]
+        c, tail = old_parse_re(tail, r',\s*')
+        commas.append(c[0])
+
+
+def old_parse_expression3(text):
+    return old_parse_any(text, [
+        old_parse_string,
+        old_parse_float,
+        old_parse_int,
+        old_parse_range,
+        old_parse_ref,
+        old_parse_call,
+        old_parse_brace,
+    ])
+
+
+def old_parse_expression2(text):
+    lhs, tail = old_parse_expression3(text)
+    while True:
+        try:
+            m, tail = old_parse_re(tail, r'\s*[*/]\s*')
+        except ParseError:
+            break
+        rhs, tail = old_parse_expression3(tail)
+        lhs = m[0].strip(), lhs, rhs, m[0]
+    return lhs, tail
+
+
+def old_parse_expression(text):
+    lhs, tail = old_parse_expression2(text)
+    while True:
+        try:
+            m, tail = old_parse_re(tail, r'\s*[-+]\s*')
+        except ParseError:
+            break
+        rhs, tail = old_parse_expression2(tail)
+        lhs = m[0].strip(), lhs, rhs, m[0]
+    return lhs, tail
+
+
+def old_parse(text):
+    expr, tail = old_parse_expression(text)
+    if tail:
+        raise ParseError(tail)
+    return expr
+
+
+def random_text(rnd, depth=0) -> str:
+    if depth > 3 or rnd.random() < 0.3:
+        return rnd.choice([
+            '1', '42', '1.5', '"foo"', '""', 'A1', '$B$2', 'AA10', 'C$3',
+            'A1:B2', '$A1:A$9',
+        ])
+    kind = rnd.random()
+    if kind < 0.5:
+        space = rnd.choice(['', ' ', '  '])
+        op = space + rnd.choice('+-*/') + space
+        return random_text(rnd, depth + 1) + op + random_text(rnd, depth + 1)
+    elif kind < 0.7:
+        return '(' + random_text(rnd, depth + 1) + ')'
+    args = [random_text(rnd, depth + 1) for _ in range(rnd.randint(1, 3))]
+    name = rnd.choice(['sum', 'power', 'max', 'Bar', 'f2'])
+    return name + '(' + rnd.choice([',', ', ']).join(args) + ')'
+
+
+def mutate(rnd, text) -> str:
+    i = rnd.randrange(len(text) + 1)
+    if rnd.random() < 0.5:
+        return text[:i] + text[i + 1:]
+    return text[:i] + rnd.choice('A1$:(),+-*/ ."a') + text[i:]
+
+
+def parse_or_error(fn, text):
+    try:
+        return fn(text)
+    except ParseError:
+        return ParseError
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_same_as_old_parser(seed):
+    rnd = random.Random(seed)
+    for _ in range(200):
+        text = random_text(rnd)
+        for _ in range(rnd.randint(0, 2)):
+            text = mutate(rnd, text)
+        assert parse_or_error(parse, text) == parse_or_error(old_parse, text)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_unparse(seed):
+    rnd = random.Random(seed)
+    for _ in range(200):
+        text = random_text(rnd)
+        assert unparse(parse(text)) == text
+
+
+def test_precedence():
+    assert parse('1-2-3')[1] == parse('1-2')
+    assert parse('1+2*3')[0] == '+'
+    assert parse('1*2+3')[0] == '+'
+
+
+def test_shift_refs():
+    expr = parse('A1+$B2*sum(C$3:$D$4)')
+    assert unparse(shift_refs(expr, (1, 2))) == 'B3+$B4*sum(D$3:$D$4)'
@@ -0,0 +1,59 @@
+import random
+
+import pytest
+from helpers import get_rows
+from helpers import get_values
+from helpers import load
+from helpers import random_raw
+from helpers import random_rows
+
+from sheet.history import History
+
+WIDTH = 5
+HEIGHT = 8
+
+
+def get_state(sheet):
+    return get_rows(sheet, WIDTH, HEIGHT), get_values(sheet, WIDTH, HEIGHT)
+
+
+def edit(rnd, sheet, history):
+    with history.record():
+        for _ in range(rnd.randint(1, 3)):
+            cell = (rnd.randrange(WIDTH), rnd.randrange(HEIGHT))
+            sheet.set(cell, random_raw(rnd, WIDTH, HEIGHT))
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_undo_redo(seed):
+    rnd = random.Random(seed)
+    sheet = load(random_rows(rnd, WIDTH, HEIGHT))
+    history = History(sheet)
+    states = [get_state(sheet)]
+    for _ in range(8):
+        edit(rnd, sheet, history)
+        states.append(get_state(sheet))
+        rows, values = states[-1]
+        assert get_values(load(rows), WIDTH, HEIGHT) == values
+
+    for state in reversed(states[:-1]):
+        assert history.undo()
+        assert get_state(sheet) == state
+    assert not history.undo()
+
+    for state in states[1:]:
+        assert history.redo()
+        assert get_state(sheet) == state
+    assert not history.redo()
+
+
+def test_edit_clears_redo():
+    sheet = load([['1', '=A1+1']])
+    history = History(sheet)
+    with history.record():
+        sheet.set((0, 0), '2')
+    history.undo()
+    with history.record():
+        sheet.set((0, 0), '3')
+    assert not history.redo()
+    assert sheet.get_value((1, 0)) == 4
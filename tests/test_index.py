@@ -0,0 +1,189 @@
+import random
+
+import pytest
+
+from sheet.expression import x2col
+from sheet.index import LookupIndex
+from sheet.sheet import Sheet
+from sheet.sheet import to_number
+
+ROWS = 40
+FUNCTIONS = {'sum': sum, 'min': min, 'max': max}
+
+
+def random_raw(rnd, y):
+    return rnd.choice([
+        '', str(rnd.randint(-5, 5)), '0.5', 'foo', f'=A{y + 1}*2', '=1/0',
+    ])
+
+
+def expected(sheet, fn, x1, y1, x2, y2):
+    try:
+        return fn(
+            to_number(sheet.get_value((x, y)))
+            for y in range(y1, y2 + 1)
+            for x in range(x1, x2 + 1)
+        )
+    except Exception as err:
+        return err
+
+
+def check(sheet, ranges):
+    for cell, (name, x1, y1, x2, y2) in ranges.items():
+        value = sheet.get_value(cell)
+        expect = expected(sheet, FUNCTIONS[name], x1, y1, x2, y2)
+        assert repr(value) == repr(expect), cell
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_aggregate_with_edits(seed):
+    rnd = random.Random(seed)
+    sheet = Sheet()
+    ranges = {}
+    with sheet.batch():
+        for y in range(ROWS):
+            sheet.set((0, y), str(rnd.randint(-5, 5)))
+            sheet.set((1, y), random_raw(rnd, y))
+            # running totals over formulas
+            sheet.set((2, y), f'=sum(B$1:B{y + 1})')
+            ranges[2, y] = ('sum', 1, 0, 1, y)
+            name = rnd.choice(list(FUNCTIONS))
+            y1, y2 = sorted(rnd.randint(0, ROWS + 5) for _ in range(2))
+            sheet.set((3, y), f'={name}(A{y1 + 1}:{x2col(1)}{y2 + 1})')
+            ranges[3, y] = (name, 0, y1, 1, y2)
+
+    for _ in range(20):
+        if rnd.random() < 0.5:
+            # only calculate some cells before the next change
+            for cell in rnd.sample(list(ranges), 5):
+                sheet.get_value(cell)
+        else:
+            check(sheet, ranges)
+        y = rnd.randrange(ROWS + 3)
+        sheet.set((rnd.randint(0, 1), y), random_raw(rnd, y))
+    check(sheet, ranges)
+
+
+def test_cached_values_are_used():
+    sheet = Sheet()
+    with sheet.batch():
+        for y in range(100):
+            sheet.set((0, y), str(y))
+            sheet.set((1, y), f'=A{y + 1}*2')
+            sheet.set((2, y), f'=sum(B$1:B{y + 1})')
+    for y in range(100):
+        sheet.get_value((1, y))
+    assert sheet.get_value((2, 99)) == 9900
+    assert list(sheet.get_index(1, 99).iter_special(0, 99)) == []
+    assert list(sheet.iter_deps((2, 99))) == []
+
+    sheet.set((0, 50), '0')
+    assert list(sheet.get_index(1, 99).iter_formulas(0, 99)) == [50]
+    assert sheet.get_value((2, 99)) == 9800
+
+
+def test_only_used_rows_and_columns():
+    sheet = Sheet()
+    with sheet.batch():
+        for y in range(1000):
+            sheet.set((0, y), str(y))
+            sheet.set((1, y), str(y))
+        sheet.set((2, 0), '=sum(A1:A3)')
+    assert sheet.get_value((2, 0)) == 3
+    assert list(sheet.index) == [0]
+    assert sheet.index[0].size == 4
+
+    sheet.set((2, 1), '=sum(A1:A100)')
+    assert sheet.get_value((2, 1)) == 4950
+    assert sheet.index[0].size == 128
+
+
+def test_max_index():
+    sheet = Sheet()
+    sheet.max_index = 64
+    with sheet.batch():
+        for y in range(50):
+            for x in range(3):
+                sheet.set((x, y), str(y))
+        for x in range(3):
+            sheet.set((x, 50), f'=sum({x2col(x)}1:{x2col(x)}50)')
+    for x in range(3):
+        assert sheet.get_value((x, 50)) == 1225
+    assert list(sheet.index) == [2]
+
+
+def test_tall_sparse_range():
+    sheet = Sheet()
+    sheet.set((0, 2), '5')
+    sheet.set((1, 0), '=sum(A1:A10000000)')
+    sheet.set((1, 1), '=min(A1:A10000000)')
+    assert sheet.get_value((1, 0)) == 5
+    assert sheet.get_value((1, 1)) == 0
+    assert sheet.index[0].size == 4
+
+    # cells below the last one grow the index
+    sheet.set((0, 1000), '-7')
+    assert sheet.get_value((1, 0)) == -2
+    assert sheet.get_value((1, 1)) == -7
+    assert sheet.index[0].size == 1024
+    # cells after the range are not included
+    sheet.set((0, 20000000), '1')
+    assert sheet.get_value((1, 0)) == -2
+    assert sheet.index[0].size == 1024
+
+
+@pytest.mark.parametrize('name', ['min', 'max'])
+def test_ties_in_row_major_order(name):
+    sheet = Sheet()
+    for y, row in enumerate([['1', '0', '-1'], ['0.0', '', '0.0']]):
+        for x, raw in enumerate(row):
+            sheet.set((x, y), raw.replace('1', '1' if name == 'min' else '-1'))
+    sheet.set((4, 0), f'={name}(A1:B2)')
+    sheet.set((4, 1), f'={name}(A2:C3)')
+    sheet.set((4, 2), f'={name}(B1:C2)')
+    sheet.set((4, 3), f'={name}(A1:B1000)')
+    fn = FUNCTIONS[name]
+    for cell, (x1, y1, x2, y2) in {
+        (4, 0): (0, 0, 1, 1),
+        (4, 1): (0, 1, 2, 2),
+        (4, 2): (1, 0, 2, 1),
+        (4, 3): (0, 0, 1, 999),
+    }.items():
+        expect = expected(sheet, fn, x1, y1, x2, y2)
+        assert repr(sheet.get_value(cell)) == repr(expect), cell
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_lookup_index(seed):
+    rnd = random.Random(seed)
+    choices = [None, 0, 1, 2, 1.5, 2.0, 'a', 'b', 'foo']
+    keys = [rnd.choice(choices) for _ in range(30)]
+    index = LookupIndex(keys)
+    ops = {
+        '=': lambda a, b: a == b,
+        '<>': lambda a, b: a != b,
+        '<': lambda a, b: a < b,
+        '<=': lambda a, b: a <= b,
+        '>': lambda a, b: a > b,
+        '>=': lambda a, b: a >= b,
+    }
+    for key in choices[1:] + [-1, 1.75, 'c']:
+        for op, cmp in ops.items():
+            expect = [
+                i for i, k in enumerate(keys)
+                if (op == '<>' and k is None) or k is not None and (
+                    op in ('=', '<>')
+                    or isinstance(k, str) == isinstance(key, str)
+                ) and cmp(k, key)
+            ]
+            assert index.find(op, key) == expect, (op, key)
+            assert index.count(op, key) == len(expect), (op, key)
+        same = [
+            (k, i) for i, k in enumerate(keys)
+            if k is not None and isinstance(k, str) == isinstance(key, str)
+        ]
+        # the last of equal keys for find_le, the first for find_ge
+        le = max([(k, i) for k, i in same if k <= key], default=None)
+        assert index.find_le(key) == (le and le[1])
+        ge = min([(k, i) for k, i in same if k >= key], default=None)
+        assert index.find_ge(key) == (ge and ge[1])
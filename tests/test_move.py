@@ -0,0 +1,97 @@
+import random
+
+import pytest
+from helpers import get_rows
+from helpers import get_values
+from helpers import load
+from helpers import random_raw
+from helpers import random_rows
+
+from sheet.expression import RefError
+from sheet.expression import parse
+from sheet.history import History
+from sheet.sheet import Sheet
+
+
+def test_deleted_references():
+    sheet = Sheet()
+    sheet.set((0, 0), '1')
+    sheet.set((0, 1), '=sum(A1:A1)+A1')
+    sheet.set((1, 1), '=A1+1')
+    sheet.set((1, 2), '=sum(A1:A2)')
+    sheet.move(1, 0, -1)
+    assert sheet.get_raw((0, 0)) == '=sum(#REF!)+#REF!'
+    assert sheet.get_raw((1, 0)) == '=#REF!+1'
+    assert sheet.get_raw((1, 1)) == '=sum(A1:A1)'
+    assert isinstance(sheet.get_value((0, 0)), RefError)
+    assert isinstance(sheet.get_value((1, 0)), RefError)
+
+
+def test_parse_deleted_reference():
+    with pytest.raises(RefError, match='reference to deleted cell'):
+        parse('#REF!+1')
+
+
+# large enough for all cells after inserting up to 2 rows or columns at a
+# time, 6 times
+WIDTH = 17
+HEIGHT = 20
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_same_as_fresh_sheet(seed):
+    rnd = random.Random(seed)
+    sheet = load(random_rows(rnd, 5, 8))
+    for _ in range(6):
+        get_values(sheet, WIDTH, HEIGHT, order=rnd)
+        axis = rnd.randint(0, 1)
+        at = rnd.randrange(5 if axis == 0 else 8)
+        n = rnd.choice([-2, -1, 1, 2])
+        sheet.move(axis, at, n)
+        fresh = load(get_rows(sheet, WIDTH, HEIGHT))
+        values = get_values(sheet, WIDTH, HEIGHT)
+        assert values == get_values(fresh, WIDTH, HEIGHT)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_insert_and_delete(seed):
+    rnd = random.Random(seed)
+    sheet = load(random_rows(rnd, 5, 8))
+    rows = get_rows(sheet, 8, 11)
+    values = get_values(sheet, 8, 11)
+    axis = rnd.randint(0, 1)
+    at = rnd.randrange(5 if axis == 0 else 8)
+    n = rnd.randint(1, 2)
+    sheet.move(axis, at, n)
+    sheet.move(axis, at, -n)
+    assert get_rows(sheet, 8, 11) == rows
+    assert get_values(sheet, 8, 11) == values
+
+
+def get_state(sheet):
+    return get_rows(sheet, WIDTH, HEIGHT), get_values(sheet, WIDTH, HEIGHT)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_undo_redo(seed):
+    rnd = random.Random(seed)
+    sheet = load(random_rows(rnd, 5, 8))
+    history = History(sheet)
+    states = [get_state(sheet)]
+    for _ in range(5):
+        if rnd.random() < 0.3:
+            with history.record():
+                cell = (rnd.randrange(5), rnd.randrange(8))
+                sheet.set(cell, random_raw(rnd, 5, 8))
+        else:
+            axis = rnd.randint(0, 1)
+            at = rnd.randrange(5 if axis == 0 else 8)
+            history.move(axis, at, rnd.choice([-2, -1, 1, 2]))
+        states.append(get_state(sheet))
+
+    for state in reversed(states[:-1]):
+        assert history.undo()
+        assert get_state(sheet) == state
+    for state in states[1:]:
+        assert history.redo()
+        assert get_state(sheet) == state
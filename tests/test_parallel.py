@@ -0,0 +1,47 @@
+import random
+
+import pytest
+from helpers import load
+from helpers import random_raw
+
+from sheet import parallel
+from sheet.csv import dump_csv
+
+
+def random_blocks(rnd, blocks, width, height):
+    # blocks of columns that only refer to themselves
+    rows = [[] for _ in range(height)]
+    for b in range(blocks):
+        for y in range(height):
+            for x in range(width):
+                raw = random_raw(rnd, width, height)
+                if rnd.random() < 0.3:
+                    raw = f'={chr(65 + b * width)}{y + 1}+1' if x else raw
+                # move references to the columns of the block
+                for i in reversed(range(width)):
+                    raw = raw.replace(chr(65 + i), chr(65 + b * width + i))
+                rows[y].append(raw)
+    return rows
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_same_as_serial(seed, tmp_path, monkeypatch):
+    monkeypatch.setattr(parallel, 'MIN_CELLS', 0)
+    rnd = random.Random(seed)
+    rows = random_blocks(rnd, 4, 2, 20)
+
+    sheet = load(rows)
+    assert parallel.evaluate_parallel(sheet, 2)
+    dump_csv(sheet, str(tmp_path / 'parallel.csv'), display=True)
+    dump_csv(load(rows), str(tmp_path / 'serial.csv'), display=True)
+
+    with open(tmp_path / 'parallel.csv') as fh:
+        result = fh.read()
+    with open(tmp_path / 'serial.csv') as fh:
+        assert result == fh.read()
+
+
+def test_single_group(monkeypatch):
+    monkeypatch.setattr(parallel, 'MIN_CELLS', 0)
+    sheet = load([['1']] + [[f'=A{y}+1'] for y in range(1, 100)])
+    assert not parallel.evaluate_parallel(sheet, 2)
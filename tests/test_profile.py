@@ -0,0 +1,48 @@
+from helpers import load
+
+from sheet.profile import Profile
+
+METHODS = ['get_value', 'parse_relative', 'aggregate', 'recompile']
+
+
+def test_methods_are_restored():
+    sheet = load([['1', '=A1*2', '=sum(A1:B1)']])
+    fns = {formula: formula.fn for formula in sheet.formulas.values()}
+    profile = Profile(sheet)
+    assert all(name in vars(sheet) for name in METHODS)
+    assert all(formula.fn is not fn for formula, fn in fns.items())
+
+    sheet.set((0, 1), '=C1+1')
+    profile.stop()
+    assert not any(name in vars(sheet) for name in METHODS)
+    assert sheet.get_value((0, 1)) == 4
+    assert profile.evals == {}
+    assert profile.hits == profile.misses == 0
+
+
+def test_counts_and_times():
+    sheet = load([['1', '=A1*2', '=sum(A1:B1)', '=C1+B1']])
+    profile = Profile(sheet)
+    assert sheet.get_value((3, 0)) == 5
+
+    counts = {cell: count for cell, (count, _) in profile.evals.items()}
+    assert counts == {(1, 0): 1, (2, 0): 1, (3, 0): 1}
+    assert list(profile.ranges) == [('sum', (0, 0), (1, 0))]
+    assert profile.ranges['sum', (0, 0), (1, 0)][0] == 1
+    # the range is calculated inside of the formula of C1
+    assert profile.evals[2, 0][1] >= profile.ranges['sum', (0, 0), (1, 0)][1]
+    # dependencies are calculated before D1 reads them
+    assert profile.misses == 1
+    assert profile.hits == 3
+
+    # cached values are not evaluated again
+    sheet.get_value((3, 0))
+    assert profile.hits == 4
+    assert profile.evals[3, 0][0] == 1
+
+    sheet.set((0, 1), '=D1+1')
+    formula = sheet.parsed[0, 1]
+    assert profile.parses[formula][0] == 1
+    assert profile.parses[formula][2] == (0, 1)
+    assert sheet.get_value((0, 1)) == 6
+    assert profile.evals[0, 1][0] == 1
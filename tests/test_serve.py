@@ -0,0 +1,44 @@
+import json
+
+from sheet.serve import Server
+
+
+def test_set_and_get(tmp_path):
+    path = str(tmp_path / 'a.csv')
+    with open(path, 'w') as fh:
+        fh.write('1,=A1*2\n')
+    server = Server()
+    assert server.run({'cmd': 'get', 'sheet': path, 'cells': ['B1']}) == [2]
+    assert server.run({
+        'cmd': 'set', 'sheet': path, 'cells': {'A1': '2', 'A2': 'foo'}
+    }) == 3
+    assert server.run({'cmd': 'get', 'sheet': path, 'range': 'A1:B2'}) == [
+        [2, 4], ['foo', None]
+    ]
+
+
+def test_nan_and_inf(tmp_path):
+    path = str(tmp_path / 'a.csv')
+    with open(path, 'w') as fh:
+        fh.write('"=power(10, 308)*10",=A1-A1\n')
+    server = Server()
+    result = server.run({'cmd': 'get', 'sheet': path, 'range': 'A1:B1'})
+    assert result == [['inf', 'nan']]
+    json.dumps(result, allow_nan=False)
+
+
+def test_files_are_closed(tmp_path):
+    path = str(tmp_path / 'a.csv')
+    with open(path, 'w') as fh:
+        fh.write('1\n2\n3\n')
+    server = Server()
+    assert server.run({'cmd': 'get', 'sheet': path, 'cells': ['A1']}) == [1]
+    source = server.sheets[path].source
+    assert not source.fh.closed
+
+    server.run({'cmd': 'load', 'sheet': path})
+    assert source.fh.closed
+    source = server.sheets[path].source
+    server.run({'cmd': 'close', 'sheet': path})
+    assert source.fh.closed
+    assert path not in server.sheets
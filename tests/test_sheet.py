@@ -0,0 +1,309 @@
+import random
+
+import pytest
+from helpers import get_rows
+from helpers import get_values
+from helpers import load
+from helpers import random_raw
+from helpers import random_rows
+
+from sheet.sheet import Sheet
+
+
+def test_long_chain():
+    n = 20000
+    sheet = load([['1']] + [[f'=A{y}+1'] for y in range(1, n)])
+    assert sheet.get_value((0, n - 1)) == n
+
+
+def test_long_chain_with_cycle():
+    n = 20000
+    sheet = load([[f'=A{n}']] + [[f'=A{y}+1'] for y in range(1, n)])
+    assert isinstance(sheet.get_value((0, n - 1)), ReferenceError)
+    assert isinstance(sheet.get_value((0, 0)), ReferenceError)
+
+
+def test_cycle():
+    sheet = load([['=B1+1', '=A1+1', '=A1', '1']])
+    for x in range(3):
+        assert isinstance(sheet.get_value((x, 0)), ReferenceError)
+    assert sheet.get_value((3, 0)) == 1
+
+    # the cycle is broken
+    sheet.set((1, 0), '=D1')
+    assert [sheet.get_value((x, 0)) for x in range(3)] == [2, 1, 2]
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_order_does_not_matter(seed):
+    rnd = random.Random(seed)
+    rows = random_rows(rnd, 5, 8)
+    expected = get_values(load(rows), 5, 8)
+    assert get_values(load(rows), 5, 8, order=rnd) == expected
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_same_as_fresh_sheet(seed):
+    # values that are kept after changes are the same as in a new sheet
+    rnd = random.Random(seed)
+    sheet = load(random_rows(rnd, 5, 8))
+    for _ in range(10):
+        get_values(sheet, 5, 8, order=rnd)
+        cell = (rnd.randrange(5), rnd.randrange(8))
+        sheet.set(cell, random_raw(rnd, 5, 8))
+        values = get_values(sheet, 5, 8, order=rnd)
+        assert values == get_values(load(get_rows(sheet, 5, 8)), 5, 8)
+
+
+def test_empty_sheet():
+    sheet = Sheet()
+    assert sheet.get_value((3, 4)) is None
+    assert sheet.get_raw((3, 4)) == ''
+
+
+LOOKUP_ROWS = [
+    ['1', 'one', '10'],
+    ['2.5', 'two', '20'],
+    ['Foo', 'three', '30'],
+    ['bar', 'four', '40'],
+    ['3', 'five', '50'],
+]
+
+
+@pytest.mark.parametrize('formula,expected', [
+    # exact matches of int, float and str keys
+    ('=vlookup(3, A1:C5, 2, 0)', 'five'),
+    ('=vlookup(2.5, A1:C5, 3, 0)', 20),
+    ('=vlookup(1.0, A1:C5, 2, 0)', 'one'),
+    ('=vlookup("foo", A1:C5, 2, 0)', 'three'),
+    ('=vlookup(A4, A1:C5, 3, 0)', 40),
+    # approximate matches only compare keys of the same kind
+    ('=vlookup(2.7, A1:C5, 2)', 'two'),
+    ('=vlookup(100, A1:C5, 2)', 'five'),
+    ('=vlookup("c", A1:C5, 2)', 'four'),
+    ('=match(3, A1:A5, 0)', 5),
+    ('=match("BAR", A1:A5, 0)', 4),
+    ('=match(2, A1:A5)', 1),
+    ('=match(2, A1:A5, 0 - 1)', 2),
+    ('=match("two", A2:C2, 0)', 2),
+    ('=countif(A1:A5, 3)', 1),
+    ('=countif(A1:A5, "FOO")', 1),
+    ('=countif(A1:A5, ">1")', 2),
+    ('=countif(A1:A5, "<=2.5")', 2),
+    ('=countif(A1:A5, "<>3")', 4),
+    ('=countif(A1:A5, ">=c")', 1),
+    ('=countif(A1:C5, "<25")', 5),
+    ('=sumif(A1:A5, ">1")', 5.5),
+    ('=sumif(A1:A5, ">1", C1:C5)', 70),
+    ('=sumif(A1:A5, "bar", C1:C5)', 40),
+    ('=sumif(A1:A5, "<>1", C1:C5)', 140),
+])
+def test_lookup(formula, expected):
+    sheet = load(LOOKUP_ROWS)
+    sheet.set((4, 0), formula)
+    value = sheet.get_value((4, 0))
+    assert value == expected
+    assert type(value) is type(expected)
+
+
+@pytest.mark.parametrize('formula,error', [
+    ('=vlookup(2, A1:C5, 2, 0)', KeyError),
+    ('=vlookup("baz", A1:C5, 2, 0)', KeyError),
+    ('=vlookup(0, A1:C5, 2)', KeyError),
+    ('=vlookup(E9, A1:C5, 2, 0)', KeyError),
+    ('=vlookup(1, A1:C5, 4)', IndexError),
+    ('=match(4, A1:A5, 0 - 1)', KeyError),
+    ('=match(1, A1:C5, 0)', ValueError),
+    ('=sumif(A1:A5, ">1", C1:C4)', ValueError),
+    ('=countif(A1:A5, 1/0)', ZeroDivisionError),
+])
+def test_lookup_error(formula, error):
+    sheet = load(LOOKUP_ROWS)
+    sheet.set((4, 0), formula)
+    assert isinstance(sheet.get_value((4, 0)), error)
+
+
+def test_lookup_invalidation():
+    sheet = load(LOOKUP_ROWS + [['=F1*2', 'six', '60']])
+    formulas = [
+        '=vlookup(4, A1:C6, 2, 0)',
+        '=match(4, A1:A6, 0)',
+        '=countif(A1:A6, ">1")',
+        '=sumif(A1:A6, ">1", C1:C6)',
+    ]
+    for y, formula in enumerate(formulas):
+        sheet.set((4, y), formula)
+
+    def get_values():
+        return [sheet.get_value((4, y)) for y in range(len(formulas))]
+
+    values = get_values()
+    assert isinstance(values[0], KeyError)
+    assert isinstance(values[1], KeyError)
+    assert values[2:] == [2, 70]
+    assert sheet.lookups
+
+    # a value in the range changes through a dependency
+    dirty = sheet.set((5, 0), '2')
+    assert {(4, y) for y in range(len(formulas))} <= dirty
+    assert get_values() == ['six', 6, 3, 130]
+
+    # a cell in the range is set directly
+    dirty = sheet.set((0, 4), 'baz')
+    assert {(4, y) for y in range(len(formulas))} <= dirty
+    assert get_values() == ['six', 6, 2, 80]
+
+    # cells outside of the ranges do not affect them
+    assert sheet.set((3, 0), '4') == {(3, 0)}
+
+
+def count_aggregates(sheet) -> list:
+    calls = []
+    aggregate = sheet.aggregate
+
+    def counted(fn, cell1, cell2):
+        calls.append((cell1, cell2))
+        return aggregate(fn, cell1, cell2)
+
+    sheet.aggregate = counted
+    return calls
+
+
+def test_constant_folding():
+    sheet = Sheet()
+    sheet.set((0, 0), '2')
+    sheet.set((1, 0), '=(1 + 2) * 3 + A1')
+    sheet.set((2, 0), '=1 / 0 + A1')
+
+    def evaluate(expr):
+        raise AssertionError(expr)
+
+    # constant parts are calculated when the formula is compiled
+    sheet.evaluate = evaluate
+    assert sheet.get_value((1, 0)) == 11
+    # errors are raised in every cell
+    sheet.evaluate = Sheet.evaluate.__get__(sheet)
+    assert isinstance(sheet.get_value((2, 0)), ZeroDivisionError)
+
+
+def test_fixed_expressions_are_shared():
+    sheet = load([
+        ['1', '=A1/sum($A$1:$A$3)'],
+        ['2', '=A2/sum($A$1:$A$3)'],
+        ['3'],
+    ])
+    calls = count_aggregates(sheet)
+    assert sheet.get_value((1, 0)) == 1 / 6
+    assert sheet.get_value((1, 1)) == 2 / 6
+    assert len(calls) == 1
+    assert sheet.shared
+
+    sheet.set((0, 2), '7')
+    assert not sheet.shared
+    assert sheet.get_value((1, 0)) == 1 / 10
+    assert sheet.get_value((1, 1)) == 2 / 10
+    assert len(calls) == 2
+
+
+def test_absolute_expressions_are_shared():
+    # the same cells with different relative references
+    sheet = load([
+        ['1', '=sum(A1:A3)*2', '=sum(A1:A3)+1', '=A1*A1/10', '=A1*A1+1'],
+        ['2', '=sum(A2:A3)*2'],
+        ['3'],
+    ])
+    assert len(sheet.templates[('sum', ('range',))]) == 3
+    calls = count_aggregates(sheet)
+    assert sheet.get_value((1, 0)) == 12
+    assert sheet.get_value((2, 0)) == 7
+    assert sheet.get_value((3, 0)) == 0.1
+    assert sheet.get_value((4, 0)) == 2
+    assert len(calls) == 1
+    # a different range with the same template is not shared
+    assert sheet.get_value((1, 1)) == 10
+    assert len(calls) == 2
+
+    sheet.set((0, 0), '4')
+    assert sheet.get_value((1, 0)) == 18
+    assert sheet.get_value((2, 0)) == 10
+    assert sheet.get_value((3, 0)) == 1.6
+    assert sheet.get_value((4, 0)) == 17
+    assert len(calls) == 3
+
+    # templates are removed with the last formula that contains them
+    for x in range(1, 5):
+        sheet.set((x, 0), '')
+    sheet.set((1, 1), '')
+    assert sheet.templates == {}
+
+
+def test_calculated_ranges():
+    sheet = load([
+        ['1', '=A1*2', '=sum($B$1:$B$2)'],
+        ['2', '=A2*2', '=sum($B$1:$B$2)+C1'],
+    ])
+    assert sheet.get_value((2, 0)) == 6
+    assert sheet.get_value((2, 1)) == 12
+    assert (1, 0, 1, 1) in sheet.calculated
+
+    sheet.set((0, 1), '5')
+    assert not sheet.calculated
+    assert sheet.get_value((2, 0)) == 12
+    assert sheet.get_value((2, 1)) == 24
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_batch_same_as_set(seed):
+    rnd = random.Random(seed)
+    rows = random_rows(rnd, 5, 8)
+    sheet = load(rows)
+    batched = load(rows)
+    get_values(sheet, 5, 8)
+    get_values(batched, 5, 8)
+    edits = [
+        ((rnd.randrange(5), rnd.randrange(8)), random_raw(rnd, 5, 8))
+        for _ in range(5)
+    ]
+    expected = set()
+    for cell, raw in edits:
+        expected.update(sheet.set(cell, raw))
+
+    with batched.batch() as dirty:
+        for cell, raw in edits:
+            # changes are applied at once, only invalidation is deferred
+            assert batched.set(cell, raw) == set()
+            assert batched.get_raw(cell) == raw
+            assert batched.changed
+        assert dirty == set()
+    assert batched.changed is None
+    assert dirty == expected
+    assert get_values(batched, 5, 8) == get_values(sheet, 5, 8)
+
+
+def test_nested_batch():
+    sheet = load([['1', '=A1*2'], ['2', '=A2*2']])
+    assert sheet.get_value((1, 0)) == 2
+    with sheet.batch() as outer:
+        sheet.set((0, 0), '3')
+        with sheet.batch() as inner:
+            sheet.set((0, 1), '4')
+        # only the outermost batch invalidates
+        assert inner == set()
+        assert sheet.get_value((1, 0)) == 2
+    assert outer == {(0, 0), (1, 0), (0, 1), (1, 1)}
+    assert sheet.get_value((1, 0)) == 6
+    assert sheet.get_value((1, 1)) == 8
+
+
+def test_batch_with_exception():
+    sheet = load([['1', '=A1*2']])
+    assert sheet.get_value((1, 0)) == 2
+    with pytest.raises(ValueError):
+        with sheet.batch():
+            sheet.set((0, 0), '3')
+            raise ValueError
+    # changes before the exception are kept and invalidated
+    assert sheet.changed is None
+    assert sheet.get_value((1, 0)) == 6
+    assert sheet.set((0, 0), '4') == {(0, 0), (1, 0)}
+    assert sheet.get_value((1, 0)) == 8
@@ -0,0 +1,37 @@
+import random
+
+import pytest
+from helpers import get_rows
+from helpers import get_values
+from helpers import load
+from helpers import random_raw
+from helpers import random_rows
+
+from sheet.expression import ParseError
+from sheet.snapshot import dump_snapshot
+from sheet.snapshot import load_snapshot
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_round_trip(seed, tmp_path):
+    rnd = random.Random(seed)
+    rows = random_rows(rnd, 5, 8)
+    rows[0][0] = '=A2+'
+    sheet = load(rows)
+    # only some values are cached
+    for _ in range(10):
+        sheet.get_value((rnd.randrange(5), rnd.randrange(8)))
+
+    path = tmp_path / 'test.sheet'
+    dump_snapshot(sheet, path)
+    loaded = load_snapshot(path)
+    assert get_rows(loaded, 5, 8) == get_rows(sheet, 5, 8)
+    assert dict(loaded.cache.items()).keys() == dict(sheet.cache.items()).keys()
+    assert isinstance(loaded.get_value((0, 0)), ParseError)
+
+    # dependencies are restored, so edits invalidate the same cells
+    for _ in range(5):
+        cell = (rnd.randrange(5), rnd.randrange(8))
+        raw = random_raw(rnd, 5, 8)
+        assert loaded.set(cell, raw) == sheet.set(cell, raw)
+        assert get_values(loaded, 5, 8) == get_values(sheet, 5, 8)
@@ -0,0 +1,51 @@
+import random
+
+import pytest
+
+from sheet.store import SHIFT
+from sheet.store import CellStore
+
+
+def move_dict(cells, axis, at, n):
+    end = at - min(n, 0)
+    result = {}
+    for cell, value in cells.items():
+        if cell[axis] < at:
+            result[cell] = value
+        elif cell[axis] >= end:
+            cell = list(cell)
+            cell[axis] += n
+            result[tuple(cell)] = value
+    return result
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_same_as_dict(seed):
+    rnd = random.Random(seed)
+    store = CellStore()
+    cells = {}
+    rows = 3 << SHIFT
+    for _ in range(500):
+        cell = (rnd.randrange(5), rnd.randrange(rows))
+        r = rnd.random()
+        if r < 0.6:
+            store[cell] = cells[cell] = rnd.random()
+        elif r < 0.9:
+            assert store.pop(cell, None) == cells.pop(cell, None)
+        else:
+            axis = rnd.randint(0, 1)
+            at = rnd.randrange(5 if axis == 0 else rows)
+            n = rnd.choice([-1, 1, 3, -(1 << SHIFT), 1 << SHIFT])
+            store.move(axis, at, n)
+            cells = move_dict(cells, axis, at, n)
+        assert len(store) == len(cells)
+    assert dict(store.items()) == cells
+    assert all(store.get(cell) == value for cell, value in cells.items())
+
+
+def test_far_away_cell():
+    store = CellStore()
+    store[0, 50_000_000] = 1
+    assert store[0, 50_000_000] == 1
+    assert sum(len(chunk) for chunk in store.columns[0].values()) == 1 << SHIFT
+    assert list(store.iter_column(0)) == [(50_000_000, 1)]
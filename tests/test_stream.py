@@ -0,0 +1,100 @@
+import sys
+
+import pytest
+
+from sheet.__main__ import main
+from sheet.csv import dump_csv
+from sheet.csv import load_csv
+from sheet.stream import stream_csv
+
+SEPARATORS = {'csv': ',', 'tsv': '\t'}
+
+
+def write_rows(path, rows, delimiter=','):
+    path.write_text(''.join(delimiter.join(row) + '\n' for row in rows))
+
+
+def evaluate(path, out):
+    dump_csv(load_csv(str(path)), str(out), display=True)
+    return out.read_text()
+
+
+def check(tmp_path, rows, window):
+    path = tmp_path / 'in.csv'
+    write_rows(path, rows)
+    assert stream_csv(str(path), str(tmp_path / 'stream.csv'), window=window)
+    result = (tmp_path / 'stream.csv').read_text()
+    assert result == evaluate(path, tmp_path / 'full.csv')
+
+
+def test_sliding_window(tmp_path):
+    rows = [['1', '', '']]
+    for y in range(2, 100):
+        rows.append([
+            f'=A{y - 1}+1',
+            f'=sum(A{max(y - 3, 1)}:A{y})',
+            f'=B{y}*2-C{y - 1}' if y > 2 else '0.5',
+        ])
+    check(tmp_path, rows, 4)
+
+
+def test_pinned_rows(tmp_path):
+    rows = [['2', '3'], ['=A1*B1', '']]
+    for y in range(3, 100):
+        rows.append([
+            f'=A{y - 1}+$A$1',
+            f'=$B$1*A{y}',
+            f'=sum($A$1:$B$2)+A{y}',
+        ])
+    check(tmp_path, rows, 4)
+
+
+def test_empty_rows(tmp_path):
+    rows = [['1'], [''], ['=A1+1'], [''], [''], ['=A3*2']]
+    check(tmp_path, rows, 4)
+
+
+@pytest.mark.parametrize('rows', [
+    # a later row
+    [['=A2+1'], ['1']],
+    # a row that left the window
+    [['1']] + [[f'=A{y - 1}+1'] for y in range(2, 50)] + [['=A1']],
+    # a range that ends in a later row
+    [['=sum(A2:A3)'], ['1'], ['2']],
+])
+def test_fall_back(tmp_path, monkeypatch, rows):
+    path = tmp_path / 'in.csv'
+    write_rows(path, rows)
+    assert not stream_csv(str(path), str(tmp_path / 'stream.csv'), window=4)
+
+    out = tmp_path / 'out.csv'
+    monkeypatch.setattr(sys, 'argv', [
+        'sheet', str(path), '--eval', str(out), '--stream',
+    ])
+    main()
+    assert out.read_text() == evaluate(path, tmp_path / 'full.csv')
+
+
+@pytest.mark.parametrize('ext_in,ext_out', [
+    ('csv', 'tsv'), ('tsv', 'csv'), ('tsv', 'tsv'),
+])
+def test_dialects(tmp_path, ext_in, ext_out):
+    path = tmp_path / f'in.{ext_in}'
+    write_rows(path, [['1', '=A1+1'], ['2', '=A2+B1']], SEPARATORS[ext_in])
+    out = tmp_path / f'stream.{ext_out}'
+    assert stream_csv(str(path), str(out))
+    assert out.read_text() == evaluate(path, tmp_path / f'full.{ext_out}')
+    sep = SEPARATORS[ext_out]
+    assert out.read_text().splitlines() == [f'1{sep}2', f'2{sep}4']
+
+
+@pytest.mark.parametrize('option', [['--jobs', '2'], ['--db', 'sheet.db']])
+def test_unsupported_options(tmp_path, monkeypatch, option):
+    path = tmp_path / 'in.csv'
+    write_rows(path, [['1']])
+    monkeypatch.setattr(sys, 'argv', [
+        'sheet', str(path), '--eval', str(tmp_path / 'out.csv'), '--stream',
+        *option,
+    ])
+    with pytest.raises(SystemExit):
+        main()
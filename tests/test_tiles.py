@@ -0,0 +1,68 @@
+import sqlite3
+
+import pytest
+
+from sheet.csv import dump_csv
+from sheet.csv import load_csv
+from sheet.snapshot import decode_value
+from sheet.snapshot import encode_value
+from sheet.tiles import SHIFT
+from sheet.tiles import Database
+
+
+def test_same_as_memory(tmp_path):
+    sheet = Database(tmp_path / 'sheet.db', max_tiles=2).sheet()
+    with sheet.batch():
+        for y in range(2000):
+            sheet.set((0, y), str(y))
+            sheet.set((1, y), f'=A{y + 1}*2')
+        sheet.set((2, 0), '=sum(B1:B2000)')
+    assert sheet.get_value((2, 0)) == 3998000
+    assert sum(index.size for index in sheet.index.values()) <= 2048
+
+
+def test_snapshot(tmp_path):
+    path = str(tmp_path / 'example.csv')
+    with open(path, 'w') as fh:
+        fh.write('1,=A1+1\n=sum(A1:B1),"foo"\n')
+    sheet = load_csv(path, db=str(tmp_path / 'sheet.db'))
+    dump_csv(sheet, str(tmp_path / 'example.sheet'))
+    snapshot = load_csv(str(tmp_path / 'example.sheet'))
+    assert snapshot.get_value((0, 1)) == 3
+    assert snapshot.get_raw((1, 0)) == '=A1+1'
+
+
+class CustomError(Exception):
+    pass
+
+
+def test_size_of_values_that_are_not_stored(tmp_path):
+    database = Database(tmp_path / 'sheet.db', max_tiles=2)
+    store = database.store('cache', encode_value, decode_value)
+    values = [1, ValueError(object()), CustomError('foo'), ValueError('bar')]
+    for y, value in enumerate(values):
+        store[0, y << SHIFT] = value
+    # all tiles are written when they are evicted or listed
+    assert len(list(store.items())) == 2
+    assert len(store) == 2
+    assert store.get((0, 0)) == 1
+    assert repr(store.get((0, 3 << SHIFT))) == repr(ValueError('bar'))
+
+
+def test_other_databases_are_not_overwritten(tmp_path):
+    path = tmp_path / 'other.db'
+    db = sqlite3.connect(path)
+    with db:
+        db.execute('CREATE TABLE raw (x INTEGER)')
+        db.execute('INSERT INTO raw VALUES (1)')
+    db.close()
+    with pytest.raises(ValueError, match='not a sheet database'):
+        Database(path)
+    db = sqlite3.connect(path)
+    assert db.execute('SELECT x FROM raw').fetchall() == [(1,)]
+    db.close()
+
+    # databases created for sheets are reused
+    path = tmp_path / 'sheet.db'
+    Database(path).sheet().set((0, 0), '1')
+    assert Database(path).sheet().get_value((0, 0)) is None
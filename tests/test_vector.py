@@ -0,0 +1,82 @@
+import random
+
+import pytest
+
+from sheet import vector
+from sheet.sheet import Bar
+from sheet.sheet import Sheet
+
+pytest.importorskip('numpy')
+
+VALUES = ['0', '1', '-3', '2.5', '0.0', '1e3', 'foo', '', str(2 ** 60)]
+OPS = ['+', '-', '*', '/']
+
+
+@pytest.fixture(autouse=True)
+def import_numpy(monkeypatch):
+    monkeypatch.setattr(vector, 'MIN_IMPORT', 0)
+
+
+def random_expr(rnd, depth=0):
+    if depth > 2 or rnd.random() < 0.3:
+        kind = rnd.choice(['ref', 'ref', 'int', 'float', 'fixed'])
+        if kind == 'ref':
+            return f'{rnd.choice("AB")}{{y}}'
+        elif kind == 'fixed':
+            return f'$A${rnd.randint(1, 3)}'
+        elif kind == 'int':
+            return str(rnd.choice([0, 1, 2, 7, 2 ** 53, 10 ** 400]))
+        else:
+            return rnd.choice(['0.5', '2.0', '0.0'])
+    lhs = random_expr(rnd, depth + 1)
+    rhs = random_expr(rnd, depth + 1)
+    expr = f'{lhs}{rnd.choice(OPS)}{rhs}'
+    return f'({expr})' if rnd.random() < 0.5 else expr
+
+
+def fill(rows, formulas):
+    sheet = Sheet()
+    with sheet.batch():
+        for y in range(rows):
+            row = [str(y), VALUES[y % len(VALUES)]] + formulas
+            for x, raw in enumerate(row):
+                sheet.set((x, y), raw.format(y=y + 1))
+    return sheet
+
+
+def key(value):
+    if isinstance(value, Bar):
+        return 'bar', repr(value.value)
+    return type(value), repr(value)
+
+
+def get_values(sheet, rows, cols):
+    return [
+        [key(sheet.get_value((x, y))) for x in range(cols)]
+        for y in range(rows)
+    ]
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_same_as_scalar(seed):
+    rnd = random.Random(seed)
+    formulas = ['=' + random_expr(rnd) for _ in range(4)]
+    formulas.append(f'=bar({random_expr(rnd)})')
+    rows = 40
+
+    expected = get_values(fill(rows, formulas), rows, 7)
+    sheet = fill(rows, formulas)
+    vector.vectorize(sheet)
+    assert get_values(sheet, rows, 7) == expected
+
+
+def test_constant_division_by_zero():
+    sheet = fill(20, ['=A{y}+1/(2-2)'])
+    vector.vectorize(sheet)
+    assert repr(sheet.get_value((2, 5))) == repr(ZeroDivisionError('division by zero'))
+
+
+def test_large_int_literal():
+    sheet = fill(20, [f'=A{{y}}+{10 ** 400}'])
+    vector.vectorize(sheet)
+    assert sheet.get_value((2, 5)) == 5 + 10 ** 400
@@ -0,0 +1,70 @@
+import os
+import sys
+
+import pytest
+
+from sheet.__main__ import main
+from sheet.watch import Watcher
+from sheet.watch import get_stat
+
+
+def test_update(tmp_path):
+    path = tmp_path / 'in.csv'
+    out = tmp_path / 'out.csv'
+    path.write_text('1,=A1+1\n2,=A2+B1\n')
+    watcher = Watcher(str(path), str(out))
+    watcher.update(watcher.read())
+    watcher.write(set())
+    stat = get_stat(str(path))
+    assert out.read_text() == '1,2\n2,4\n'
+
+    path.write_text('5,=A1+1\n2,=A2+B1\n3\n')
+    os.utime(path, ns=(stat[0] + 1, stat[0] + 1))
+    stat = watcher.poll(stat)
+    assert out.read_text() == '5,6\n2,8\n3,\n'
+
+
+def test_missing_file(tmp_path):
+    path = tmp_path / 'in.csv'
+    out = tmp_path / 'out.csv'
+    path.write_text('1,=A1+1\n')
+    watcher = Watcher(str(path), str(out))
+    watcher.update(watcher.read())
+    watcher.write(set())
+    stat = get_stat(str(path))
+
+    path.unlink()
+    assert watcher.poll(stat) == stat
+
+    path.write_text('2,=A1+1\n')
+    assert watcher.poll(stat) != stat
+    assert out.read_text() == '2,3\n'
+
+
+@pytest.mark.parametrize('ext_in,ext_out', [
+    ('csv', 'tsv'), ('tsv', 'csv'), ('tsv', 'tsv'),
+])
+def test_dialects(tmp_path, ext_in, ext_out):
+    sep_in = '\t' if ext_in == 'tsv' else ','
+    sep_out = '\t' if ext_out == 'tsv' else ','
+    path = tmp_path / f'in.{ext_in}'
+    out = tmp_path / f'out.{ext_out}'
+    path.write_text(f'1{sep_in}=A1+1\n2{sep_in}=A2+B1\n')
+    watcher = Watcher(str(path), str(out))
+    watcher.update(watcher.read())
+    watcher.write(set())
+    assert out.read_text() == f'1{sep_out}2\n2{sep_out}4\n'
+
+
+@pytest.mark.parametrize('option', [
+    ['--db', 'sheet.db'], ['--jobs', '2'], ['--profile'], ['--stream'],
+])
+def test_unsupported_options(tmp_path, monkeypatch, option):
+    path = tmp_path / 'in.csv'
+    path.write_text('1\n')
+    monkeypatch.setattr(sys, 'argv', [
+        'sheet', str(path), '--eval', str(tmp_path / 'out.csv'), '--watch',
+        *option,
+    ])
+    with pytest.raises(SystemExit):
+        main()
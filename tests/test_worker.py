@@ -0,0 +1,69 @@
+import time
+
+from sheet.sheet import Sheet
+from sheet.worker import Worker
+
+
+def wait(worker, cells, timeout=5):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        with worker.lock:
+            if all(cell in worker.sheet.cache for cell in cells):
+                return True
+        time.sleep(0.001)
+    return False
+
+
+def test_step_skips_cells_that_are_no_longer_formulas():
+    sheet = Sheet()
+    sheet.set((0, 0), '=Z1+1')
+    sheet.set((25, 0), '=2')
+    worker = Worker(sheet, lambda: None)
+    worker.stop()
+
+    worker.request([(0, 0)])
+    worker.step()
+    assert worker.stack == [(0, 0), (25, 0)]
+
+    # e.g. pasting over an off-screen cell
+    sheet.set((25, 0), '5')
+    while worker.stack:
+        worker.step()
+    assert sheet.cache[0, 0] == 6
+
+
+def test_request_resets_after_change():
+    sheet = Sheet()
+    sheet.set((0, 0), '=Z1+1')
+    sheet.set((25, 0), '=2')
+    worker = Worker(sheet, lambda: None)
+    worker.stop()
+
+    worker.request([(0, 0)])
+    worker.step()
+    sheet.set((25, 0), '=A2')
+    worker.request([(0, 0)], changed=True)
+    assert worker.stack == [(0, 0)]
+    assert not worker.visited
+
+
+def test_errors_do_not_stop_the_thread():
+    sheet = Sheet()
+    sheet.set((0, 0), '=B1+1')
+    sheet.set((0, 1), '=1')
+    iter_deps = sheet.iter_deps
+
+    def failing_iter_deps(cell):
+        if cell == (0, 0):
+            raise AttributeError(cell)
+        return iter_deps(cell)
+
+    sheet.iter_deps = failing_iter_deps
+    worker = Worker(sheet, lambda: None)
+    try:
+        with worker.lock:
+            worker.request([(0, 0), (0, 1)])
+        assert wait(worker, [(0, 1)])
+        assert worker.thread.is_alive()
+    finally:
+        worker.stop()